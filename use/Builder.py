@@ -1,5 +1,5 @@
-import sys, logging
-from .Action import CommandFailed
+import sys, hashlib, logging
+from .Action import Command, CommandFailed
 from .conv import to_list
 
 class Builder(object):
@@ -13,28 +13,38 @@ class Builder(object):
         self.options = dict(options)
         self.options['sources'] = self.sources
         self.options['targets'] = self.targets
+        self._signature = None
 
     def __eq__(self, op):
         # TODO: Need to compare actions.
-        return self.options == op.options
+        return self._compared_options(self.options) == self._compared_options(op.options)
 
     def __ne__(self, op):
         return not self.__eq__(op)
 
+    ##
+    ## Number of CPU tokens a job for this builder takes.
+    ##
     @property
-    def dependent_nodes(self):
-        return self.sources + self.depends
+    def weight(self):
+        return self.options.get('weight', 1)
 
-    def build_sources(self, ctx):
-        logging.debug('Builder: Building sources.')
+    ##
+    ## Memory, in MB, a job for this builder is expected to use.
+    ##
+    @property
+    def memory(self):
+        return self.options.get('memory', 0)
 
-        invalid = False
-        for src in self.sources:
-            this = src.build(ctx)
-            invalid = invalid or this
+    @property
+    def dependent_nodes(self):
+        return self.sources + self.depends
 
-        logging.debug('Builder: Done building sources.')
-        return invalid
+    ##
+    ## Render the command lines of each of my command actions.
+    ##
+    def command_strings(self):
+        return [a.get_command(self.options) for a in self.actions if isinstance(a, Command)]
 
     def update(self, ctx):
         logging.debug('Builder: Updating.')
@@ -45,6 +55,8 @@ class Builder(object):
             except CommandFailed as ex:
                 sys.stdout.write(ex.command.stdout)
                 sys.stderr.write(ex.command.stderr)
+                if ctx.argument('keep_going'):
+                    raise
                 self.ctx.exit(exception=ex) # keep throwing if in parallel
         self.post_update(ctx)
 
@@ -52,3 +64,37 @@ class Builder(object):
 
     def post_update(self, ctx):
         pass
+
+    ##
+    ## A digest of my rendered command lines and options, for comparing
+    ## against the builder used on a previous run. Nodes are named by
+    ## path. Calculated once, when first needed.
+    ##
+    def signature(self):
+        if self._signature is None:
+            hsh = hashlib.sha1()
+            for action in self.actions:
+                hsh.update(action.__class__.__name__ + '\0')
+                if isinstance(action, Command):
+                    hsh.update(action.get_command(self.options) + '\0')
+            hsh.update(repr(_plain(self._compared_options(self.options))))
+            self._signature = hsh.hexdigest()
+        return self._signature
+
+    ##
+    ## Scheduling options and the scanner don't affect what is built.
+    ##
+    def _compared_options(self, opts):
+        return dict((k, v) for k, v in opts.iteritems() if k not in ['weight', 'memory', 'scanner'])
+
+def _plain(value):
+    from .Node import Node
+    if isinstance(value, Node):
+        return repr(value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _plain(v)) for k, v in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_plain(v) for v in value)
+    elif isinstance(value, type) or callable(value):
+        return getattr(value, '__module__', '') + '.' + getattr(value, '__name__', repr(value))
+    return value
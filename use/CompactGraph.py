@@ -0,0 +1,127 @@
+from array import array
+import logging
+
+__all__ = ['CompactGraph']
+
+##
+## The dependency graph of a set of targets, frozen into compressed
+## sparse row arrays. Nodes are numbered in depth first order from the
+## targets. The inputs of node i (its builder's sources and its scanned
+## dependencies) are in_edges[in_start[i]:in_start[i + 1]], and the
+## nodes using it as an input are found the same way through out_start
+## and out_edges. All traversals are iterative.
+##
+class CompactGraph(object):
+
+    def __init__(self, targets):
+        self.nodes = []
+        self._index = {}
+        starts = array('l', [0])
+        edges = array('l')
+
+        # Number the nodes as they are first reached, recording the
+        # inputs of each once all of them have numbers.
+        stack = [(t, False) for t in reversed(targets)]
+        pending = {}
+        while stack:
+            node, expanded = stack.pop()
+            if expanded:
+                pending[id(node)] = [self._index[id(i)] for i in _inputs(node)]
+                continue
+            if id(node) in self._index:
+                continue
+            self._index[id(node)] = len(self.nodes)
+            self.nodes.append(node)
+            stack.append((node, True))
+            stack.extend((i, False) for i in reversed(_inputs(node)))
+        for node in self.nodes:
+            edges.extend(pending[id(node)])
+            starts.append(len(edges))
+        self.in_start = starts
+        self.in_edges = edges
+
+        # Build the reverse index by counting the uses of each node.
+        size = len(self.nodes)
+        counts = array('l', [0])*(size + 1)
+        for idx in edges:
+            counts[idx + 1] += 1
+        for idx in xrange(size):
+            counts[idx + 1] += counts[idx]
+        self.out_start = array('l', counts)
+        self.out_edges = array('l', [0])*len(edges)
+        fill = array('l', counts)
+        for idx in xrange(size):
+            for inp in edges[starts[idx]:starts[idx + 1]]:
+                self.out_edges[fill[inp]] = idx
+                fill[inp] += 1
+        logging.debug('CompactGraph: Have %d nodes and %d edges.'%(size, len(edges)))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index(self, node):
+        return self._index.get(id(node), None)
+
+    def inputs(self, idx):
+        return self.in_edges[self.in_start[idx]:self.in_start[idx + 1]]
+
+    def outputs(self, idx):
+        return self.out_edges[self.out_start[idx]:self.out_start[idx + 1]]
+
+    def num_inputs(self, idx):
+        return self.in_start[idx + 1] - self.in_start[idx]
+
+    def leaves(self):
+        return [i for i in xrange(len(self.nodes)) if self.in_start[i] == self.in_start[i + 1]]
+
+    ##
+    ## Indices in an order where every node follows its inputs. Nodes
+    ## in a cycle are left out.
+    ##
+    def topological_order(self):
+        remaining = array('l', (self.num_inputs(i) for i in xrange(len(self.nodes))))
+        order = array('l', self.leaves())
+        pos = 0
+        while pos < len(order):
+            for dep in self.outputs(order[pos]):
+                remaining[dep] -= 1
+                if not remaining[dep]:
+                    order.append(dep)
+            pos += 1
+        return order
+
+    ##
+    ## The given nodes and everything built from them. Nodes not in
+    ## the graph are returned as they are.
+    ##
+    def downstream(self, nodes):
+        seen = bytearray(len(self.nodes))
+        stack = []
+        found = []
+        for n in nodes:
+            idx = self.index(n)
+            if idx is None:
+                found.append(n)
+            else:
+                stack.append(idx)
+        while stack:
+            idx = stack.pop()
+            if seen[idx]:
+                continue
+            seen[idx] = 1
+            found.append(self.nodes[idx])
+            stack.extend(self.outputs(idx))
+        return found
+
+##
+## Unique inputs of a node, in order.
+##
+def _inputs(node):
+    inputs = []
+    done = set()
+    srcs = node.builder.sources if node.builder is not None else []
+    for inp in list(srcs) + list(node.dependencies):
+        if id(inp) not in done:
+            done.add(id(inp))
+            inputs.append(inp)
+    return inputs
@@ -1,15 +1,19 @@
-import sys, os, argparse, pickle
-try:
-    import threadpool
-except:
-    pass
-from utils import getarg, load_class
+import sys, os, argparse
+from utils import getarg, load_class, run_threaded
 from .Use import Use
 from .Rule import *
 from .Resolver import Resolver
 from .Argument import Arguments
-from .Options import OptionDict
+from .Options import OptionDict, OptionJoin
 from .File import File
+from .Scheduler import Scheduler
+from .Trace import Trace
+from .JobServer import JobServer
+from .Watcher import make_watcher
+from .Platform import platform
+from .Digest import digest_types
+from .State import State
+from .Scanner import IncludeGraph
 from .conv import to_list
 import logging
 
@@ -19,17 +23,31 @@ import logging
 ##
 class Context(object):
 
+    # Directories not searched for sources unless a rule names them.
+    default_ignored = ['.external', '.git', '.hg', '.svn', '.bzr', 'CVS']
+
     def __init__(self):
         self.packages = []
         self.rules = []
         self.uses = []
         self._node_map = {}
+        self.graph = None
+        self.includes = IncludeGraph(self)
+        self.ignored = list(self.default_ignored)
         self.targets = []
         self.resolver = Resolver()
         self._pkg_map = {}
-        self.crcs = {}
-        self.src_crcs = {}
-        self.old_bldrs = {}
+        self.state = State('.use.db')
+        self.crcs = self.state.crcs
+        self.src_crcs = self.state.source_crcs
+        self.stats = self.state.stats
+        self.durations = self.state.durations
+        self.digest_type = 'crc32'
+        self.old_bldrs = self.state.builders
+        self.trace = Trace()
+        self._jobserver = None
+        self._old_ctx = None
+        self._old_args = None
         self._exiting = False
 
         self.arguments = None
@@ -38,8 +56,15 @@ class Context(object):
         self.parser = argparse.ArgumentParser('"Use": Software configuration and build.')
         self.parser.add_argument('targets', nargs='*', help='Specify build targets.')
         self.parser.add_argument('-s', dest='show_config', action='store_true', help='Show current configuration.')
+        self.parser.add_argument('--trace', dest='trace', metavar='FILE', help='Write a timeline of the build in trace event format.')
+        self.parser.add_argument('--watch', dest='watch', action='store_true', help='Rebuild whenever source files change.')
+        self.parser.add_argument('-k', '--keep-going', dest='keep_going', action='store_true', help='Keep building independent targets after a failure.')
+        self.parser.add_argument('--daemon', dest='daemon', action='store_true', help='Build, then keep serving builds from a background process.')
+        self.parser.add_argument('--stop-daemon', dest='stop_daemon', action='store_true', help='Stop a running build daemon.')
         self.new_arguments()('--enable-download-all', dest='download_all', action='boolean', help='Download and install all dependencies.')
-        self.new_arguments()('-j', dest='num_threads', type=int, default=1, help='Number of threads.')
+        self.new_arguments()('-j', dest='num_threads', type=int, help='Number of CPU tokens for concurrent jobs (default: from cores and free memory).')
+        self.new_arguments()('--digest', dest='digest', choices=sorted(digest_types.keys()), default='crc32', help='Hash used to detect file changes.')
+        self.new_arguments()('--memory', dest='memory', type=int, help='Memory budget in MB for concurrent jobs (default: free memory).')
 
     def __eq__(self, op):
 
@@ -81,9 +106,14 @@ class Context(object):
 
         # Check if we have an old structure to use, unless the user
         # requested a reconfiguration.
-        if 'configure' not in self.arguments.targets and os.path.exists('.use.db'):
-            with open('.use.db', 'r') as inf:
-                old_ctx = pickle.load(inf)
+        self._old_args = self.state.load_config('arguments')
+        old_ctx = self._load_old_ctx() if 'configure' not in self.arguments.targets else None
+        if old_ctx is not None:
+
+            # Arguments from the last run supersede those stored when
+            # configuring.
+            if self._old_args is not None:
+                old_ctx.arguments.__dict__.update(self._old_args['arguments'])
 
             # Only update arguments if nothing for that argument was
             # given on the command line.
@@ -104,6 +134,8 @@ class Context(object):
         for pkg in self.packages:
             pkg.parse_arguments(self.arguments)
 
+        self.digest_type = self.argument('digest')
+
     def argument(self, name):
         val = getattr(self.arguments, name, None)
         if val is None:
@@ -129,7 +161,8 @@ class Context(object):
             if pkg.explicit:
                 sys.stdout.write('    ' + pkg.name + '\n')
 
-        # Check for downloads.
+        # Check for downloads. Package builds share the jobserver.
+        self.jobserver()
         sys.stdout.write('  Installing packages...\n')
         for pkg in self.packages:
             pkg.check_download()
@@ -163,13 +196,11 @@ class Context(object):
             self.resolver(self)
             sys.stdout.write(' done.\n')
 
-        # Clear CRCs and old builders.
-        self.crcs = {}
-        self.src_crcs = {}
-        self.old_bldrs = {}
+        # Clear CRCs, durations and old builders.
+        self.state.clear()
 
         # Save configuration results.
-        self.save()
+        self.save(config=True)
 
         sys.stdout.write('  Success.\n')
         sys.stdout.write('  Configuration details:\n')
@@ -197,16 +228,12 @@ class Context(object):
             return True
 
         # If we have not run before then definitely configure.
-        if not os.path.exists('.use.db'):
+        if self._load_old_ctx() is None:
             sys.stdout.write('No prior configuration to use.\n')
             return True
 
         # Check if anything has changed in the build structure.
-        if os.path.exists('.use.db'):
-            with open('.use.db', 'r') as inf:
-                old_ctx = pickle.load(inf)
-        else:
-            old_ctx = None
+        old_ctx = self._load_old_ctx()
         if self != old_ctx:
             sys.stdout.write('Build structure has changed.\n')
             return True
@@ -219,15 +246,46 @@ class Context(object):
 
         # Now use the old context.
         self._use_old_ctx(old_ctx)
+        self._old_ctx = None
 
         return False
 
     ##
-    ## Scan files for rule sources.
+    ## Scan files for rule sources, walking the tree once for all rules.
+    ## Ignored directories and those products are built into are left
+    ## out.
     ##
     def find_sources(self):
+        found = match_sources([r.source for r in self.rules if isinstance(r.source, basestring)],
+                              self.ignored, self.build_prefixes())
         for rule in self.rules:
-            rule.find_sources(self)
+            rule.find_sources(self, found)
+
+    ##
+    ## Directories products are placed under, from the "prefix" and
+    ## "target_prefix" options of each use and rule.
+    ##
+    def build_prefixes(self):
+        prefixes = set()
+        for holder in self.uses + self.rules:
+            opts = getattr(holder, 'options', None)
+            if not isinstance(opts, (OptionDict, OptionJoin)):
+                continue
+            opts = opts.get()
+            for name in ['prefix', 'target_prefix']:
+                pre = opts.get(name, None)
+                if pre:
+                    pre = os.path.normpath(self.norm_path(str(pre)))
+                    if pre != '.' and not pre.startswith('..') and not os.path.isabs(pre):
+                        prefixes.add(pre)
+        return sorted(prefixes)
+
+    ##
+    ## Don't search directories whose name or path matches any of the
+    ## given patterns for sources.
+    ##
+    def new_ignore(self, *patterns):
+        self.ignored.extend(patterns)
 
     ##
     ## Expand sources into objects.
@@ -239,6 +297,17 @@ class Context(object):
 
     def scan(self):
         logging.debug('Context: Scanning for dependencies.')
+
+        # Read the files the scanners will want up front, in parallel.
+        pairs = []
+        for rule in self.rules:
+            for srcs, bldr, dsts in rule.productions:
+                hdr_dirs = tuple(bldr.options.get('header_dirs', []))
+                if self.stored_dependencies(bldr) is None:
+                    pairs.extend((s, hdr_dirs) for s in srcs
+                                 if s.scanner is not None and s.scanner.key(bldr) not in s._done_scan)
+        self.includes.prefetch(pairs, self.argument('num_threads') or platform.num_cpus())
+
         done = False
         while not done:
             done = True
@@ -247,6 +316,29 @@ class Context(object):
                 done = tmp if tmp is False else done
         logging.debug('Context: Done scanning for dependencies.')
 
+    ##
+    ## The dependencies the compiler wrote out when the builder last
+    ## ran, or None if it doesn't write dependency files or hasn't run.
+    ##
+    def stored_dependencies(self, bldr):
+        if not bldr.options.get('dependency_files', False) or not bldr.targets:
+            return None
+        paths = self.state.dependencies.get(bldr.targets[0].id)
+        if paths is None:
+            return None
+        return [self.file(p) for p in paths]
+
+    ##
+    ## Keep the dependencies a builder's compiler wrote out for the next
+    ## run. The sources are marked to be scanned again, so a refresh
+    ## picks up the new edges.
+    ##
+    def store_dependencies(self, bldr, paths):
+        srcs = set(str(s) for s in bldr.sources)
+        self.state.dependencies[bldr.targets[0].id] = [p for p in paths if p not in srcs]
+        for src in bldr.sources:
+            src._done_scan = ()
+
     ##
     ## After creating all the flows we need to augment them to include
     ## package dependencies.
@@ -338,40 +430,128 @@ class Context(object):
     def build(self):
         logging.debug('Context: Building targets.')
 
-        if self.argument('num_threads') == 1:
-            for tgt in self.targets:
-                tgt.build(self)
-        else:
+        with self.trace.phase('build'):
+            trace = self.trace if self.argument('trace') else None
+            jobserver = self.jobserver()
+            memory = self.argument('memory') or platform.available_memory()
+            self._scheduler = Scheduler(self, jobserver.num_jobs, self.argument('keep_going'), trace, memory, jobserver)
+            self._scheduler.add_targets(self.targets)
+            self.graph = self._scheduler.graph
+            with self.trace.phase('hash'):
+                self.hash_sources(self._scheduler.nodes, jobserver.num_jobs)
             try:
-                self._pool = threadpool.ThreadPool(self.argument('num_threads'))
-            except:
-                print '\nRequested parallel build, but threadpool not installed.\n'
-                sys.exit(1)
-            leafs = []
-            for tgt in self.targets:
-                leafs.extend(tgt.make_jobs(self))
-            for l in leafs:
-                self.job(l)
-            try:
-                self._pool.wait()
-            except threadpool.NoWorkersAvailable as ex:
-                pass
-            del self._pool
+                self._scheduler.run()
+            finally:
+                self.close_jobserver()
+            failures = self._scheduler.failures
+            del self._scheduler
 
         # Check if we had a problem.
         if self._exiting:
             self.exit()
 
         # Save state.
-        self.update_node_crcs()
-        self.save()
+        with self.trace.phase('save'):
+            self.update_node_crcs()
+            self.save()
+        self.write_trace()
+
+        # Report on any failures from keeping going.
+        if failures:
+            self.write_failures(sys.stdout, failures)
+            sys.exit(1)
 
         logging.debug('Context: Done building targets.')
 
-    def job(self, node):
-        logging.debug('Context: Adding job for node: ' + str(node))
-        # self._jobs.append(node)
-        self._pool.putRequest(threadpool.WorkRequest(node.build_job, [self]))
+    ##
+    ## Build, then keep the graph in memory and rebuild whenever
+    ## any source files change.
+    ##
+    def watch(self):
+        self.rebuild()
+        watcher = make_watcher(self.source_paths())
+        try:
+            while True:
+                sys.stdout.write('Watching for changes...\n')
+                sys.stdout.flush()
+                if self.refresh(watcher.wait()):
+                    self.rebuild()
+                    watcher.update(self.source_paths())
+        finally:
+            watcher.close()
+
+    ##
+    ## Prepare the in-memory graph to be built again after the given
+    ## files have changed. Returns False if none of them are nodes.
+    ##
+    def refresh(self, paths):
+        logging.debug('Context: Changed: ' + str(paths))
+        nodes = [self.find_node(p) for p in paths]
+        nodes = [n for n in nodes if n is not None]
+        self.includes.forget(paths)
+
+        # Rescan anything that may have new includes, then forget
+        # the stat signatures of the changes so they are hashed again.
+        # Anything downstream is caught by comparing CRCs.
+        stale = set(n for n in self._node_map.itervalues() if n.scanner is not None and not n._done_scan)
+        for n in (self.graph.downstream(nodes) if self.graph is not None else nodes):
+            if n.scanner is not None:
+                stale.add(n)
+        for n in stale:
+            n.rescan(self)
+        for n in self._node_map.itervalues():
+            n.reset()
+        for n in nodes:
+            self.stats.pop(n.id, None)
+        return len(nodes) > 0
+
+    ##
+    ## Build without exiting, returning the exit code.
+    ##
+    def rebuild(self):
+        self._exiting = False
+        try:
+            self.build()
+        except SystemExit as ex:
+            return ex.code if ex.code is not None else 0
+        return 0
+
+    def source_paths(self):
+        return [n.path for n in self._node_map.itervalues() if n.builder is None and isinstance(n, File)]
+
+    ##
+    ## Stat and hash source files ahead of the build, spread over a
+    ## pool of threads. Results are stored on the nodes to be used when
+    ## checking validity.
+    ##
+    def hash_sources(self, nodes, num_threads):
+        srcs = [n for n in nodes if n.builder is None and isinstance(n, File)]
+        logging.debug('Context: Hashing %d sources.'%len(srcs))
+        run_threaded(lambda n: n.load_crc(n.path, self), srcs, num_threads)
+
+    def write_failures(self, strm, failures):
+        blocked = [n for n in self._node_map.itervalues() if n.seen and n._blocked]
+        strm.write('\nBuild failed, %d commands failed and %d nodes were not built:\n'%(len(failures), len(blocked)))
+        for node, ex in failures:
+            strm.write('  ' + str(node) + '\n')
+            strm.write('    ' + ex.command.command_string + '\n')
+
+    ##
+    ## The jobserver shared by our jobs and any makes we run.
+    ##
+    def jobserver(self):
+        if self._jobserver is None:
+            self._jobserver = JobServer(self.argument('num_threads') or platform.default_jobs())
+        return self._jobserver
+
+    ##
+    ## Release the jobserver's pipe and restore MAKEFLAGS. Another is
+    ## made if more jobs are run.
+    ##
+    def close_jobserver(self):
+        if self._jobserver is not None:
+            self._jobserver.close()
+            self._jobserver = None
 
     def new_arguments(self):
         return Arguments(self)
@@ -444,81 +624,131 @@ class Context(object):
 
     def exit(self, save=True, exception=None):
 
-        # If we have a threadpool member we need to signal to them all that we are
-        # exiting and have them terminate.
-        if hasattr(self, '_pool'):
+        # If we have a scheduler we need to signal to it that we are
+        # exiting and have it stop dispatching jobs.
+        if hasattr(self, '_scheduler'):
             if not self._exiting:
                 self._exiting = True
-                logging.debug('Dismissing workers.')
-                self._pool.dismissWorkers(self.argument('num_threads'))
+                logging.debug('Stopping scheduler.')
+                self._scheduler.stop()
             raise exception # keep throwing
         
         if save:
             self.update_node_crcs()
             self.save()
+        self.write_trace()
+        self.close_jobserver()
         sys.exit(1)
 
+    ##
+    ## Write the build timeline if one was requested.
+    ##
+    def write_trace(self):
+        path = self.argument('trace')
+        if path:
+            self.trace.write(path)
+
     def node_crc(self, node):
-        return self.crcs.get(repr(node), None)
+        return self.crcs.get(node.id, None)
 
     def node_source_crcs(self, node):
-        return self.src_crcs.get(repr(node), None)
+        return self.src_crcs.get(node.id, None)
+
+    def node_stat(self, node):
+        return self.stats.get(node.id, None)
+
+    def node_duration(self, node):
+        return self.durations.get(node.id, None)
 
     def update_node_crcs(self):
         for n in self._node_map.itervalues():
             self.update_node_crc(n)
 
-        to_del = [k for k, v in self.crcs.iteritems() if v is None]
-        for k in to_del:
-            del self.crcs[k]
-
-        to_del = [k for k, v in self.src_crcs.iteritems() if v is None]
-        for k in to_del:
-            del self.src_crcs[k]
+    ##
+    ## Record the state of a node whose builder has run, so it need
+    ## not be built again if we are killed before saving. Nothing else
+    ## changes during a build, so other nodes are left for the save.
+    ##
+    def journal_node(self, node):
+        if node.builder is None or not node._invalid or node.id is None:
+            return
+        self.update_node_crc(node)
+        self.state.record(node.id)
 
     def update_node_crc(self, node):
 
-        # Don't update the node if it has not been seen.
-        if node.seen:
-            self.crcs[repr(node)] = node.current_crc(self)
-            self.src_crcs[repr(node)] = node.current_source_crcs(self)
+        # Don't update the node if it has not been seen, or
+        # was blocked by a failure. Products that never ran keep
+        # their old records, so they are still compared against the
+        # inputs they were last built from.
+        if node.id is not None and node.seen and not node._blocked and (node.builder is None or node._job_done):
+            key = node.id
+
+            # Stat signatures are only valid alongside their CRC.
+            crc = node.current_crc(self)
+            if crc is None:
+                self.crcs.pop(key, None)
+                self.stats.pop(key, None)
+            else:
+                self.crcs[key] = crc
+                if node._stat is not None:
+                    self.stats[key] = node._stat
+
+            src_crcs = node.current_source_crcs(self)
+            if src_crcs is None:
+                self.src_crcs.pop(key, None)
+            else:
+                self.src_crcs[key] = src_crcs
+            if node._duration is not None:
+                self.durations[key] = node._duration
+            if node.builder is not None:
+                self.old_bldrs[key] = node.builder.signature()
 
     ##
-    ## Store context state to file.
+    ## Store context state to file. The context itself only changes when
+    ## configuring, so is only written then. Otherwise just the changed
+    ## node rows and arguments are, and a build that changes nothing
+    ## writes nothing.
     ##
-    def save(self):
+    def save(self, config=False):
+        args = self._saved_arguments()
+        if args is not None:
+            self._old_args = args
+        if not config:
+            self.state.save(arguments=args)
+            return
 
-        # Parser won't pickle.
-        try:
-            parser = self.parser
-        except:
-            # TODO: Sometimes there is an error here.
-            import pdb
-            pdb.set_trace()
+        # Parser, node map and run-time helpers won't pickle, and the
+        # node tables are written row by row by the state.
+        transient = {}
+        for attr in ['parser', '_arg_map', '_node_map', 'graph', 'trace', '_scheduler', '_jobserver', '_old_ctx',
+                     'includes', 'state', 'crcs', 'src_crcs', 'stats', 'durations', 'old_bldrs']:
+            if hasattr(self, attr):
+                transient[attr] = getattr(self, attr)
+                delattr(self, attr)
         targets = self.arguments.targets
-        _arg_map = self._arg_map
-        _node_map = self._node_map
-        del self.parser
+        trace_path = getattr(self.arguments, 'trace', None)
         self.arguments.targets = None
-        del self._arg_map
-        del self._node_map
-        if hasattr(self, '_pool'):
-            del self._pool
-
-        # Set the pickle recursion limit much higher.
-        sys.setrecursionlimit(10000)
+        self.arguments.trace = None
 
-        with open('.use.db', 'w') as out:
-            pickle.dump(self, out)
-
-        # Reset recursion limit.
-        sys.setrecursionlimit(1000)
+        transient['state'].save(self, args)
 
         # Reset.
-        self.parser = parser
+        for attr, val in transient.iteritems():
+            setattr(self, attr, val)
         self.arguments.targets = targets
-        self._arg_map = _arg_map
-        self._node_map = _node_map
+        self.arguments.trace = trace_path
+
+    ##
+    ## Arguments and digest of this run, to be used by the next, or None
+    ## if unchanged since the last run. Single-run flags are left out.
+    ##
+    def _saved_arguments(self):
+        if self.arguments is None:
+            return None
+        args = dict((k, getattr(self.arguments, k, None)) for k in self._arg_map)
+        saved = {'digest_type': self.digest_type, 'arguments': args}
+        return saved if saved != self._old_args else None
 
     ##
     ## Load context from file.
@@ -526,6 +756,14 @@ class Context(object):
     def load(self, base_dir):
         pass
 
+    ##
+    ## Load the previous configuration, only once per run.
+    ##
+    def _load_old_ctx(self):
+        if self._old_ctx is None:
+            self._old_ctx = self.state.load_config()
+        return self._old_ctx
+
     def _use_old_ctx(self, old_ctx):
 
         # Copy over all the package contents.
@@ -547,25 +785,29 @@ class Context(object):
                             inst.features.append(ftr)
                             inst._ftr_map[ftr.name] = ftr
 
-        # Copy over CRCs.
-        self.crcs = old_ctx.crcs
-        self.src_crcs = old_ctx.src_crcs
-
-        # Build a suite of old builders.
-        self.old_bldrs = old_ctx.old_bldrs
-        for rule in old_ctx.rules:
-            for n in rule.product_nodes:
-                if n.builder is not None:
-                    self.old_bldrs[repr(n)] = n.builder
+        # CRCs made with a different digest are of no use. The digest of
+        # the last run is stored with its arguments.
+        old_digest = old_ctx.digest_type if self._old_args is None else self._old_args['digest_type']
+        if old_digest != self.digest_type:
+            sys.stdout.write('File digest has changed, rebuilding.\n')
+            self.state.clear(['crcs', 'source_crcs', 'stats'])
 
         # Run the resolver again.
         if self.resolver is not None:
             self.resolver(self)
 
+    ##
+    ## Find or create a node. Existing nodes are found by key, without
+    ## making a new one.
+    ##
     def node(self, node_class, *args, **kwargs):
-        n = node_class(*args, **kwargs)
-        rep = repr(n)
-        return self._node_map.setdefault(rep, n)
+        key = node_class.key(*args, **kwargs)
+        n = self._node_map.get(key, None)
+        if n is None:
+            n = node_class(*args, **kwargs)
+            n.id = self.state.node_id(key)
+            n = self._node_map.setdefault(key, n)
+        return n
 
     def file(self, *args, **kwargs):
         return self.node(File, *args, **kwargs)
@@ -599,8 +841,13 @@ class Context(object):
             for k, v in self.arguments.__dict__.iteritems():
                 if k in ['show_config']:
                     continue
+
+                # Flags for a single run, like "-k", aren't configuration
+                # and have no entry.
+                arg = self._arg_map.get(k)
+                if arg is None:
+                    continue
                 if v is not None and (not isinstance(v, list) or len(v) > 0):
-                    arg = self._arg_map.get(k)
                     strm.write(indent*' ' + '{} {}\n'.format(arg.option_strings[0], v))
             indent -= 2
             strm.write('Current configuration:\n')
@@ -0,0 +1,253 @@
+import os, sys, socket, struct, json, threading, argparse, logging
+from .Trace import Trace
+from .Watcher import make_watcher
+
+__all__ = ['Server', 'run_client', 'stop_daemon']
+
+##
+## The daemon listens on a Unix socket in the project directory.
+##
+SOCKET_PATH = '.use.sock'
+
+##
+## Messages are framed as a kind byte and a length. Clients send a
+## request ('q'). Servers send output ('o' and 'e'), then either an
+## exit code ('x') or a request to run without the daemon ('r').
+##
+def send_message(sock, kind, data=''):
+    sock.sendall(struct.pack('!cI', kind, len(data)) + data)
+
+def recv_message(sock):
+    kind, size = struct.unpack('!cI', _recv_exact(sock, 5))
+    return kind, _recv_exact(sock, size)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        data = sock.recv(size)
+        if not data:
+            raise EOFError
+        chunks.append(data)
+        size -= len(data)
+    return ''.join(chunks)
+
+##
+## File-like object forwarding output to a client.
+##
+class SocketStream(object):
+
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        if data:
+            send_message(self.sock, self.kind, data)
+
+    def flush(self):
+        pass
+
+##
+## Keeps a fully built context in memory and builds on request from
+## clients. Source changes are collected by a watcher thread between
+## requests. Only that thread touches the watcher; the paths to watch
+## are handed to it after each build. If the usescript changes, or another run rewrites the
+## state file, the server shuts down and clients run normally.
+##
+class Server(object):
+
+    def __init__(self, ctx, script, path=SOCKET_PATH):
+        self.ctx = ctx
+        self.script = script
+        self.path = path
+        self._parser = argparse.ArgumentParser(add_help=False)
+        self._parser.add_argument('targets', nargs='*')
+        self._parser.add_argument('-k', '--keep-going', dest='keep_going', action='store_true')
+        self._parser.add_argument('--trace', dest='trace')
+        self._changed = set()
+        self._paths = None
+        self._lock = threading.Lock()
+        self._running = True
+
+    ##
+    ## Build once, detach from the terminal, then serve requests.
+    ##
+    def start(self):
+        if self._is_live():
+            sys.stdout.write('A daemon is already running for this project.\n')
+            sys.exit(1)
+        self.ctx.rebuild()
+        self._script_stat = self._stat(self.script)
+        self._db_stat = self._stat('.use.db')
+        self.ctx.state.close()
+        if os.fork():
+            sys.stdout.write('Daemon started.\n')
+            os._exit(0)
+        os.setsid()
+        null = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(null, fd)
+        self.serve()
+
+    def serve(self):
+        logging.debug('Server: Serving on ' + self.path)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen(5)
+        self._paths = self.ctx.source_paths()
+        thr = threading.Thread(target=self._watch)
+        thr.daemon = True
+        thr.start()
+        try:
+            while self._running:
+                conn, addr = sock.accept()
+                try:
+                    self._handle(conn)
+                except (socket.error, EOFError):
+                    logging.debug('Server: Lost client.')
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        logging.debug('Server: Done serving.')
+
+    def _handle(self, conn):
+        kind, data = recv_message(conn)
+        req = json.loads(data)
+        if req.get('stop', False):
+            self._running = False
+            send_message(conn, 'x', '0')
+            return
+
+        # Anything we can't handle from memory is run normally.
+        args = self._parse(req.get('argv', []))
+        if args is None:
+            send_message(conn, 'r')
+            return
+        if self._stale():
+            self._running = False
+            send_message(conn, 'r')
+            return
+
+        with self._lock:
+            changed = self._changed
+            self._changed = set()
+        ctx = self.ctx
+        ctx.refresh(changed)
+        ctx.trace = Trace()
+        ctx.arguments.targets = args.targets
+        ctx.arguments.keep_going = args.keep_going
+        ctx.arguments.trace = args.trace
+        ctx.find_targets()
+
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout = SocketStream(conn, 'o')
+        sys.stderr = SocketStream(conn, 'e')
+        try:
+            code = ctx.rebuild()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self._db_stat = self._stat('.use.db')
+        with self._lock:
+            self._paths = ctx.source_paths()
+        send_message(conn, 'x', str(code))
+
+    def _parse(self, argv):
+        args, extra = self._parser.parse_known_args(argv)
+        if extra or 'configure' in args.targets or 'reconfigure' in args.targets:
+            return None
+        return args
+
+    def _stale(self):
+        return self._stat(self.script) != self._script_stat or self._stat('.use.db') != self._db_stat
+
+    ##
+    ## Collect changes until the server stops, picking up new paths to
+    ## watch between waits.
+    ##
+    def _watch(self):
+        watcher = None
+        while self._running:
+            with self._lock:
+                paths, self._paths = self._paths, None
+            if paths is not None:
+                if watcher is None:
+                    watcher = make_watcher(paths)
+                else:
+                    watcher.update(paths)
+            changed = watcher.wait(watcher.interval)
+            if changed:
+                with self._lock:
+                    self._changed.update(changed)
+        watcher.close()
+
+    def _is_live(self):
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+            sock.close()
+            return True
+        except socket.error:
+            return False
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime, st.st_ino)
+
+def _connect(path):
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        return None
+    return sock
+
+##
+## Have a running daemon perform the build. Returns the exit code, or
+## None if there is no daemon or the build must be run normally.
+##
+def run_client(argv, path=SOCKET_PATH):
+    sock = _connect(path)
+    if sock is None:
+        return None
+    try:
+        send_message(sock, 'q', json.dumps({'argv': argv}))
+        while True:
+            kind, data = recv_message(sock)
+            if kind == 'o':
+                sys.stdout.write(data)
+                sys.stdout.flush()
+            elif kind == 'e':
+                sys.stderr.write(data)
+            elif kind == 'x':
+                return int(data)
+            else:
+                return None
+    except (socket.error, EOFError):
+        return None
+    finally:
+        sock.close()
+
+def stop_daemon(path=SOCKET_PATH):
+    sock = _connect(path)
+    if sock is None:
+        return False
+    try:
+        send_message(sock, 'q', json.dumps({'stop': True}))
+        recv_message(sock)
+    except (socket.error, EOFError):
+        pass
+    finally:
+        sock.close()
+    return True
@@ -0,0 +1,92 @@
+import binascii, zlib, hashlib
+
+# Faster or stronger hashes are optional.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+try:
+    from hashlib import blake2b
+except ImportError:
+    try:
+        from pyblake2 import blake2b
+    except ImportError:
+        blake2b = None
+
+__all__ = ['digest_types', 'file_digest', 'data_digest']
+
+##
+## Size of the chunks files are read in. Hashing a file never holds
+## more than this in memory.
+##
+CHUNK_SIZE = 1 << 20
+
+class Crc32(object):
+
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        self._value = binascii.crc32(data, self._value)
+
+    def digest(self):
+        return self._value & 0xFFFFFFFF
+
+class Adler32(object):
+
+    def __init__(self):
+        self._value = 1
+
+    def update(self, data):
+        self._value = zlib.adler32(data, self._value)
+
+    def digest(self):
+        return self._value & 0xFFFFFFFF
+
+##
+## Wraps hash objects that produce a byte digest.
+##
+class HexDigest(object):
+
+    def __init__(self, factory):
+        self._hash = factory()
+
+    def update(self, data):
+        self._hash.update(data)
+
+    def digest(self):
+        return self._hash.hexdigest()
+
+digest_types = {
+    'crc32': Crc32,
+    'adler32': Adler32,
+    'md5': lambda: HexDigest(hashlib.md5),
+    'sha1': lambda: HexDigest(hashlib.sha1),
+    'sha256': lambda: HexDigest(hashlib.sha256),
+}
+if blake2b is not None:
+    digest_types['blake2b'] = lambda: HexDigest(blake2b)
+if xxhash is not None:
+    digest_types['xxh64'] = lambda: HexDigest(xxhash.xxh64)
+
+##
+## Digest a file in fixed size chunks. Returns None if the file
+## can't be read.
+##
+def file_digest(filename, kind='crc32'):
+    hsh = digest_types[kind]()
+    try:
+        with open(filename, 'rb') as inf:
+            while True:
+                data = inf.read(CHUNK_SIZE)
+                if not data:
+                    break
+                hsh.update(data)
+    except IOError:
+        return None
+    return hsh.digest()
+
+def data_digest(data, kind='crc32'):
+    hsh = digest_types[kind]()
+    hsh.update(data)
+    return hsh.digest()
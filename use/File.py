@@ -2,16 +2,27 @@ import os
 from .Node import *
 
 class File(Node):
+    __slots__ = ('path',)
 
     def __init__(self, path, *args, **kwargs):
         Node.__init__(self, *args, **kwargs)
-        self.path = path
-        self.abspath = os.path.abspath(path)
-        self.absdirname = os.path.dirname(self.abspath)
+        self.path = intern(path) if type(path) is str else path
 
     def __repr__(self):
         return self.path
 
+    @classmethod
+    def key(cls, path, *args, **kwargs):
+        return path
+
+    @property
+    def abspath(self):
+        return os.path.abspath(self.path)
+
+    @property
+    def absdirname(self):
+        return os.path.dirname(self.abspath)
+
     def invalidated(self, ctx):
 
         # If we have a builder then we know this node is a product.
@@ -38,5 +49,6 @@ class File(Node):
         logging.debug('File: Updating node: ' + str(self))
         super(File, self).update(ctx)
         if self._new_crc is None:
-            self._new_crc = self._crc32_file(self.path)
+            self._stat = self._stat_file(self.path)
+            self._new_crc = self._digest_file(self.path, ctx)
         logging.debug('File: Done updating node: ' + str(self))
@@ -88,8 +88,10 @@ class Installer(object):
                     # Perform substitutions.
                     cmd = cmd.format(prefix=dst_path)
 
+                    # Leave the jobserver descriptors open so any make
+                    # shares the context's parallelism budget.
                     try:
-                        subprocess.check_call(shlex.split(cmd), stdout=stdout_log, stderr=subprocess.STDOUT)
+                        subprocess.check_call(shlex.split(cmd), stdout=stdout_log, stderr=subprocess.STDOUT, close_fds=False)
                     except:
                         if not allow_errors:
                             return False
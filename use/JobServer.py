@@ -0,0 +1,81 @@
+import os, re, errno, threading, logging
+
+##
+## A GNU make compatible jobserver. If we were launched from a make
+## that is running a jobserver we join it, otherwise we create one with
+## a pipe holding a token for every job slot but the first. Exporting
+## MAKEFLAGS lets any make run by a command or a package installation
+## share the same parallelism budget as our own jobs.
+##
+class JobServer(object):
+
+    auth_prog = re.compile(r'--jobserver-(?:auth|fds)=(\d+),(\d+)')
+    fifo_prog = re.compile(r'--jobserver-auth=fifo:(\S+)')
+    jobs_prog = re.compile(r'(?:^|\s)-j(\d+)')
+
+    def __init__(self, num_jobs):
+        self.num_jobs = num_jobs
+        self.joined = False
+        self._old_flags = os.environ.get('MAKEFLAGS', None)
+        self._lock = threading.Lock()
+        if not self._join(os.environ.get('MAKEFLAGS', '')):
+            self._create()
+
+    ##
+    ## Take n tokens. Blocks until they are available.
+    ##
+    def acquire(self, n):
+        tokens = []
+        with self._lock:
+            while len(tokens) < n:
+                try:
+                    tok = os.read(self._read_fd, 1)
+                except OSError as ex:
+                    if ex.errno == errno.EINTR:
+                        continue
+                    raise
+                if tok:
+                    tokens.append(tok)
+        return tokens
+
+    def release(self, tokens):
+        for tok in tokens:
+            os.write(self._write_fd, tok)
+
+    def close(self):
+        if not self.joined:
+            logging.debug('JobServer: Closing.')
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            if self._old_flags is None:
+                del os.environ['MAKEFLAGS']
+            else:
+                os.environ['MAKEFLAGS'] = self._old_flags
+
+    def _join(self, flags):
+        match = self.fifo_prog.search(flags)
+        try:
+            if match:
+                self._read_fd = self._write_fd = os.open(match.group(1), os.O_RDWR)
+            else:
+                match = self.auth_prog.search(flags)
+                if not match:
+                    return False
+                self._read_fd, self._write_fd = int(match.group(1)), int(match.group(2))
+                os.fstat(self._read_fd)
+                os.fstat(self._write_fd)
+        except OSError:
+            logging.debug('JobServer: Unable to join jobserver: ' + flags)
+            return False
+        match = self.jobs_prog.search(flags)
+        if match:
+            self.num_jobs = int(match.group(1))
+        self.joined = True
+        logging.debug('JobServer: Joined jobserver with %d jobs.'%self.num_jobs)
+        return True
+
+    def _create(self):
+        self._read_fd, self._write_fd = os.pipe()
+        self.release(['+']*(self.num_jobs - 1))
+        os.environ['MAKEFLAGS'] = ' -j%d --jobserver-auth=%d,%d'%(self.num_jobs, self._read_fd, self._write_fd)
+        logging.debug('JobServer: Created jobserver with %d jobs.'%self.num_jobs)
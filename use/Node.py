@@ -1,24 +1,31 @@
-import logging, threading
+import time, logging
 from .Validatable import Validatable
-from .Action import CommandFailed
 
+##
+## Nodes are slotted and share an empty tuple for each of their edge
+## lists until something is added, as builds have a great many of
+## them. The ID is given by the context when the node is registered.
+##
 class Node(Validatable):
+    __slots__ = ('id', 'rule', 'builder', 'products', 'dependencies', 'progenitors', 'scanner',
+                 'seen', '_invalid', '_src_crcs', '_duration', '_done_scan', '_job_done', '_blocked')
 
     def __init__(self, *args, **kwargs):
         super(Node, self).__init__()
+        self.id = None
         self.rule = None
         self.builder = None
-        self.products = []
-        self.dependencies = []
-        self.progenitors = []
+        self.products = ()
+        self.dependencies = ()
+        self.progenitors = ()
         self.scanner = None
         self.seen = False
         self._invalid = False
         self._src_crcs = None
-        self._done_scan = False
+        self._duration = None
+        self._done_scan = ()
         self._job_done = False
-        self._in_queue = False
-        self._lock = threading.Lock()
+        self._blocked = False
 
     def __eq__(self, op):
         return repr(self) == repr(op)
@@ -29,44 +36,52 @@ class Node(Validatable):
     def __repr__(self):
         return 'Node'
 
-    def make_jobs(self, ctx):
-        logging.debug('Node: Creating job for: ' + str(self))
-
-        # If we've already processed this node don't do
-        # so again.
-        if self.seen:
-            logging.debug('Node: Already seen this node.')
-            return []
-
-        self.seen = True
+    ##
+    ## The key a node made from these arguments is registered under,
+    ## which must match its repr.
+    ##
+    @classmethod
+    def key(cls, *args, **kwargs):
+        return repr(cls(*args, **kwargs))
 
-        # If there are any dependencies, produce the next set and
-        # return it.
-        if (self.builder and self.builder.sources) or self.dependencies:
-            logging.debug('Node: Have dependences/sources.')
-            leafs = []
-            if self.builder:
-                for src in self.builder.sources:
-                    leafs.extend(src.make_jobs(ctx))
-            for dep in self.dependencies:
-                leafs.extend(dep.make_jobs(ctx))
-            return leafs
+    ##
+    ## Edge lists become lists on the first addition, and are extended
+    ## in place after that. A header included by many sources would
+    ## otherwise copy its progenitors for each of them.
+    ##
+    def add_products(self, nodes):
+        if self.products:
+            self.products.extend(nodes)
+        else:
+            self.products = list(nodes)
 
-        # Add to job queue.
-        self._in_queue = True
-        # ctx.job(self)
-        return [self]
+    def add_dependencies(self, nodes):
+        if self.dependencies:
+            self.dependencies.extend(nodes)
+        else:
+            self.dependencies = list(nodes)
+        for nd in nodes:
+            if nd.progenitors:
+                nd.progenitors.append(self)
+            else:
+                nd.progenitors = [self]
 
-    def build_job(self, ctx):
+    ##
+    ## Check my validity and update me if needed. Any slot given is
+    ## entered only while my builder runs, so resources such as
+    ## jobserver tokens aren't held for nodes that are up to date.
+    ##
+    def build_job(self, ctx, slot=None):
         logging.debug('Node: Building job: ' + str(self))
 
-        # Grab validity of sources.
-        if self.builder:
-            for src in self.builder.sources:
-                if src._invalid:
-                    self._invalid = True
-                    logging.debug('Node: Parents are invalidated.')
-                    break
+        # Rebuilt inputs only invalidate me if their content changed,
+        # which is caught by comparing CRCs below. Inputs without any
+        # content to compare always do.
+        for src in self.input_nodes():
+            if src._invalid and src._new_crc is None:
+                self._invalid = True
+                logging.debug('Node: Parents are invalidated.')
+                break
 
         # Calculate my validity.
         if not self._invalid:
@@ -74,112 +89,14 @@ class Node(Validatable):
             logging.debug('Node: Is invalidated: ' + str(self._invalid))
 
         if self._invalid:
-            self.invalidate_progenitors(ctx)
-            try:
+            if slot is not None and self.builder:
+                with slot:
+                    self.update(ctx)
+            else:
                 self.update(ctx)
-            except CommandFailed:
-                return # don't allow job to be completed
 
         self._job_done = True
-
-        for n in self.products:
-            n.ready_check(ctx)
-        for n in self.progenitors:
-            n.ready_check(ctx)
-
-    def ready_check(self, ctx):
-        self._lock.acquire()
-        logging.debug('Node: ' + str(self) + ': Checking if ready.')
-
-        # Don't build if not flagged to be built.
-        if not self.seen:
-            self._lock.release()
-            logging.debug('Node: ' + str(self) + ': Not flagged to be built.')
-            return
-
-        # Don't do anything if we've already been processed, or
-        # if we're already in the queue.
-        if self._job_done or self._in_queue:
-            self._lock.release()
-            logging.debug('Node: ' + str(self) + ': Already done/in queue.')
-            return
-
-        # Can only process this node if all dependencies are done.
-        if self.builder:
-            for src in self.builder.sources:
-                if not src._job_done:
-                    self._lock.release()
-                    logging.debug('Node: ' + str(self) + ': Sources not built.')
-                    return
-        for dep in self.dependencies:
-            if not dep._job_done:
-                self._lock.release()
-                logging.debug('Node: ' + str(self) + ': Dependencies not built: ' + str(dep))
-                return
-
-        # Send new job to job queue.
-        logging.debug('Node: ' + str(self) + ': Sending to job queue.')
-        self._in_queue = True
-        self._lock.release()
-        ctx.job(self)
-
-    ##
-    ## Called to process this node.
-    ##
-    def build(self, ctx):
-        logging.debug('Node: Building node: ' + str(self))
-
-        # If we've already processed this node don't do
-        # so again.
-        if self.seen:
-            logging.debug('Node: Already seen this node.')
-            return self._invalid
-
-        # Call out to our parents first.
-        if self.builder:
-            self._invalid = self.builder.build_sources(ctx)
-            if self._invalid:
-                logging.debug('Node: Parents are invalidated.')
-
-        # Build our dependencies.
-        invalid = self.build_dependencies(ctx)
-        if invalid:
-            self._invalid = invalid
-            logging.debug('Node: Dependencies are invalidated.')
-
-        # If our parents are invalidated we must rebuild. If not,
-        # check if we're invalidated in any other way.
-        if not self._invalid:
-            self._invalid = self.invalidated(ctx)
-            logging.debug('Node: Set invalidated state to %s'%self._invalid)
-
-        # If we are invalid perform an update.
-        if self._invalid:
-
-            # Flag all other nodes dependent on this one that
-            # they are now invalidated.
-            self.invalidate_progenitors(ctx)
-
-            # Do the update.
-            self.update(ctx)
-
-        # Flag as seen.
-        self.seen = True
-
-        # Return our invalidation state.
-        logging.debug('Node: Done building node: ' + str(self))
-        return self._invalid
-
-    def build_dependencies(self, ctx):
-        logging.debug('Node: Building dependencies.')
-
-        invalid = False
-        for dep in self.dependencies:
-            this = dep.build(ctx)
-            invalid = invalid or this
-
-        logging.debug('Node: Done building dependencies.')
-        return invalid
+        return True
 
     ##
     ## Determine if this node is invalidated.
@@ -201,15 +118,15 @@ class Node(Validatable):
             old_src_crcs = ctx.node_source_crcs(self)
             if old_src_crcs is None:
                 return True
-            for src in self.builder.dependent_nodes:
-                crc = old_src_crcs.get(repr(src), None)
+            for src in self.input_nodes():
+                crc = old_src_crcs.get(src.id, None)
                 if crc is None or crc != src.current_crc(ctx):
                     return True
 
             # Also check if the builder has changed.
             if hasattr(ctx, 'old_bldrs'):
-                old_bldr = ctx.old_bldrs.get(repr(self), None)
-                if old_bldr is None or self.builder != old_bldr:
+                old_sig = ctx.old_bldrs.get(self.id, None)
+                if old_sig is None or self.builder.signature() != old_sig:
                     return True
 
         return False
@@ -220,7 +137,9 @@ class Node(Validatable):
     def update(self, ctx):
         logging.debug('Node: Updating node: ' + str(self))
         if self.builder:
+            start = time.time()
             self.builder.update(ctx)
+            self._duration = time.time() - start
         logging.debug('Node: Done updating node: ' + str(self))
 
     def scan(self, ctx, bldr):
@@ -231,59 +150,93 @@ class Node(Validatable):
                 scanner = scanner(ctx)
         else:
             scanner = self.scanner
-        if not self._done_scan:
-            if scanner is not None:
+
+        # A source may be built in several ways, each finding different
+        # dependencies, so I keep the union of those found for each
+        # distinct scan.
+        deps = ctx.stored_dependencies(bldr)
+        if deps is not None:
+            key = ('dependencies', bldr.targets[0].id)
+        elif scanner is not None:
+            key = scanner.key(bldr)
+        else:
+            key = None
+        if key is not None and key not in self._done_scan:
+            if deps is not None:
+                logging.debug('Node: Using stored dependencies.')
+            else:
                 logging.debug('Node: Using scanner: ' + str(scanner.__class__))
-                with open(str(self), 'r') as src_file:
-                    data = src_file.read()
-                new_deps = list(scanner.find_all(self, data, bldr))
-                logging.debug('Node: New dependencies: ' + str(new_deps))
-                self.dependencies.extend(new_deps)
-                for nd in new_deps:
-                    nd.progenitors.append(self)
-                self._new_crc = self._crc32(data)
+                deps = list(scanner.find_all(self, bldr))
+                logging.debug('Node: New dependencies: ' + str(deps))
+            done = set(id(n) for n in self.dependencies)
+            self.add_dependencies([n for n in deps if id(n) not in done])
+            self._done_scan = self._done_scan + (key,)
         logging.debug('Node: Done scanning.')
 
     def update_source_crcs(self, ctx):
         if self.builder:
             self._src_crcs = {}
-            for src in self.builder.dependent_nodes:
+            for src in self.input_nodes():
                 cur_crc = src.current_crc(ctx)
-                if cur_crc is not None:
-                    self._src_crcs[repr(src)] = cur_crc
+                if cur_crc is not None and src.id is not None:
+                    self._src_crcs[src.id] = cur_crc
         else:
             self._src_crcs = None
 
+    ##
+    ## The nodes I am built from: my builder's sources and explicit
+    ## dependencies, plus the scanned dependencies of each of those
+    ## and of myself.
+    ##
+    def input_nodes(self):
+        nodes = []
+        done = set()
+        srcs = self.builder.dependent_nodes if self.builder else []
+        for src in srcs:
+            for n in [src] + list(src.dependencies):
+                if id(n) not in done:
+                    done.add(id(n))
+                    nodes.append(n)
+        for n in self.dependencies:
+            if id(n) not in done:
+                done.add(id(n))
+                nodes.append(n)
+        return nodes
+
     def current_source_crcs(self, ctx):
         if self._src_crcs is None:
             self.update_source_crcs(ctx)
         return self._src_crcs
 
-    def invalidate_progenitors(self, ctx):
-
-        # Stop if there is no CRC stored on the context.
-        if ctx.node_crc(self) is None:
-            return
-
-        # Remove the context's CRC.
-        del ctx.crcs[repr(self)]
-
-        # Call for all up builder targets.
-        for n in self.products:
-            n.invalidate_progenitors(ctx)
-        for n in self.progenitors:
-            n.invalidate_progenitors(ctx)
-
-    def __getstate__(self):
-        state = self.__dict__.copy()
-        del state['_lock']
-        return state
+    ##
+    ## Scan again for dependencies, replacing the existing ones.
+    ##
+    def rescan(self, ctx):
+        for dep in self.dependencies:
+            dep.progenitors = [p for p in dep.progenitors if p is not self]
+        self.dependencies = ()
+        self._done_scan = ()
+        for prod in self.products:
+            if prod.builder is not None:
+                self.scan(ctx, prod.builder)
 
-    def __setstate__(self, state):
-        self.__dict__.update(state)
-        self._lock = threading.Lock()
+    ##
+    ## Clear the state of a previous build so this node can
+    ## be built again.
+    ##
+    def reset(self):
+        self.seen = False
+        self._invalid = False
+        self._job_done = False
+        self._blocked = False
+        self._src_crcs = None
+        self._duration = None
+        self._crc = None
+        self._new_crc = None
+        self._stat = None
 
 class Always(Node):
+    __slots__ = ('path',)
 
     def __init__(self, *args, **kwargs):
         super(Always, self).__init__(*args, **kwargs)
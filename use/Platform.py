@@ -1,4 +1,4 @@
-import os, platform, sys, glob
+import os, platform, sys, glob, multiprocessing
 from .Location import Location
 from .conv import to_list
 from .utils import strip_missing, run_command
@@ -57,6 +57,39 @@ class Platform(object):
         new_lib_dirs.extend(post)
         return new_lib_dirs
 
+    def num_cpus(self):
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+
+    ##
+    ## Available memory in MB, or None if it can't be determined.
+    ##
+    def available_memory(self):
+        try:
+            with open('/proc/meminfo', 'r') as inf:
+                for line in inf:
+                    if line.startswith('MemAvailable:'):
+                        return int(line.split()[1])//1024
+        except (IOError, ValueError, IndexError):
+            pass
+        try:
+            return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')//(1024*1024)
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    ##
+    ## Default number of concurrent jobs, limited by both the number
+    ## of cores and the memory available for jobs of the given size.
+    ##
+    def default_jobs(self, job_memory=512):
+        jobs = self.num_cpus()
+        mem = self.available_memory()
+        if mem is not None:
+            jobs = min(jobs, mem//job_memory)
+        return max(jobs, 1)
+
     def _set_os(self, os_name):
         self.os_name = os_name.lower()
         try:
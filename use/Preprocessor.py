@@ -0,0 +1,249 @@
+import re
+
+__all__ = ['read_directives', 'included_names', 'macro_definitions']
+
+directives = set(['if', 'ifdef', 'ifndef', 'elif', 'else', 'endif', 'define', 'undef', 'include'])
+
+# Comments are removed, but string and character literals are matched
+# too so comment markers inside them are left alone.
+strip_prog = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+line_prog = re.compile(r'^[ \t]*#[ \t]*(\w+)(.*)$', re.MULTILINE)
+hdr_prog = re.compile(r'\s*(?:<([^>]*)>|"([^"]*)")')
+define_prog = re.compile(r'\s*(\w+)(\()?\s*(.*)$')
+tok_prog = re.compile(r'\s*(?:(\d\w*)|(\w+)|(&&|\|\||==|!=|<=|>=|<<|>>|[!~<>()+\-*/%&|^]))')
+
+##
+## The preprocessor directives of a file that affect which headers it
+## includes, as (directive, argument) pairs. Comments are removed
+## first. Empty if the file can't be read.
+##
+def read_directives(path):
+    try:
+        with open(path, 'r') as src_file:
+            data = src_file.read()
+    except IOError:
+        return []
+    data = data.replace('\\\n', '')
+    data = strip_prog.sub(lambda m: ' ' if m.group(0)[0] == '/' else m.group(0), data)
+    return [(d, a.strip()) for d, a in line_prog.findall(data) if d in directives]
+
+##
+## Convert a "define" option into a set of (name, value) pairs, added to
+## any macros given.
+##
+def macro_definitions(defines, macros=None):
+    if isinstance(defines, (basestring, tuple)):
+        defines = [defines]
+    macros = dict(macros or ())
+    for d in defines or []:
+        if isinstance(d, tuple):
+            macros[str(d[0])] = str(d[1])
+        elif '=' in str(d):
+            name, value = str(d).split('=', 1)
+            macros[name] = value
+        else:
+            macros[str(d)] = '1'
+    return frozenset(macros.iteritems())
+
+##
+## Names of the headers included by a set of directives. With no
+## defines every include is given. Otherwise conditionals are evaluated
+## with the given (name, value) macro pairs and those defined or
+## undefined earlier in the same directives. Any other macro may have
+## been defined by an earlier header, so conditions that depend on one
+## are unknown, and includes under unknown conditions are kept. An
+## include guard is taken to be undefined, as the file adds nothing
+## when it is defined.
+##
+def included_names(dirs, defines=None):
+    if defines is None:
+        return [n for n in (_header(a) for d, a in dirs if d == 'include') if n is not None]
+    macros = dict(defines)
+    undefined = set()
+    names = []
+
+    # Each open conditional holds whether its current branch is live and
+    # whether an earlier branch was, each as True, False or None for
+    # unknown.
+    stack = []
+    live = True
+    for ii, (directive, arg) in enumerate(dirs):
+        if directive in ('if', 'ifdef', 'ifndef'):
+            if live is False:
+                stack.append([False, True])
+            else:
+                value = _condition(directive, arg, macros, undefined)
+                if value is None and directive == 'ifndef' and _guard(arg, dirs[ii + 1:ii + 2]):
+                    value = True
+                stack.append([value, value])
+        elif directive in ('elif', 'else'):
+            if not stack:
+                continue
+            frame = stack[-1]
+            value = True if directive == 'else' else None
+            if frame[1] is not True and directive == 'elif':
+                value = _condition('if', arg, macros, undefined)
+            frame[0] = _branch(frame[1], value)
+            frame[1] = True if frame[1] is True or value is True else (None if frame[1] is None or value is None else False)
+        elif directive == 'endif':
+            if stack:
+                stack.pop()
+        elif live is False:
+            continue
+        elif directive == 'include':
+            name = _header(arg)
+            if name is not None:
+                names.append(name)
+        else:
+            match = define_prog.match(arg)
+            if match is None:
+                continue
+            name = match.group(1)
+            macros.pop(name, None)
+            undefined.discard(name)
+            if live is None:
+                continue
+            elif directive == 'define':
+                macros[name] = None if match.group(2) else match.group(3)
+            else:
+                undefined.add(name)
+        states = [f[0] for f in stack]
+        live = False if False in states else (None if None in states else True)
+    return names
+
+def _header(arg):
+    match = hdr_prog.match(arg)
+    if match is None:
+        return None
+    return match.group(1) or match.group(2)
+
+def _guard(arg, following):
+    if not following or following[0][0] != 'define':
+        return False
+    match = define_prog.match(following[0][1])
+    return match is not None and match.group(1) == arg.split()[0]
+
+def _branch(done, value):
+    if done is True:
+        return False
+    elif done is None:
+        return False if value is False else None
+    return value
+
+def _condition(directive, arg, macros, undefined):
+    if directive == 'if':
+        value = _Expression(arg, macros, undefined).evaluate()
+        return None if value is None else value != 0
+    name = arg.split()[0] if arg.split() else ''
+    if name not in macros and name not in undefined:
+        return None
+    return (name in macros) == (directive == 'ifdef')
+
+##
+## A "#if" expression, evaluated to an integer or to None if it uses
+## macros that are neither defined nor undefined, or can't be parsed.
+##
+class _Expression(object):
+
+    binary = [['||'], ['&&'], ['|'], ['^'], ['&'], ['==', '!='], ['<', '>', '<=', '>='],
+              ['<<', '>>'], ['+', '-'], ['*', '/', '%']]
+
+    def __init__(self, text, macros, undefined, depth=0):
+        self.macros = macros
+        self.undefined = undefined
+        self.depth = depth
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = tok_prog.match(text, pos)
+            if match is None:
+                self.tokens = None
+                break
+            self.tokens.append(match.group(1) or match.group(2) or match.group(3))
+            pos = match.end()
+        self.pos = 0
+
+    def evaluate(self):
+        if not self.tokens or self.depth > 8:
+            return None
+        try:
+            value = self._binary(0)
+        except (ValueError, IndexError):
+            return None
+        return value if self.pos == len(self.tokens) else None
+
+    def _next(self):
+        tok = self.tokens[self.pos]
+        self.pos += 1
+        return tok
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _binary(self, level):
+        if level == len(self.binary):
+            return self._unary()
+        left = self._binary(level + 1)
+        while self._peek() in self.binary[level]:
+            op = self._next()
+            right = self._binary(level + 1)
+            left = _apply(op, left, right)
+        return left
+
+    def _unary(self):
+        tok = self._next()
+        if tok in ('!', '~', '-', '+'):
+            value = self._unary()
+            if value is None:
+                return None
+            return {'!': lambda v: int(not v), '~': lambda v: ~v, '-': lambda v: -v, '+': lambda v: v}[tok](value)
+        elif tok == '(':
+            value = self._binary(0)
+            if self._next() != ')':
+                raise ValueError
+            return value
+        elif tok == 'defined':
+            paren = self._peek() == '('
+            if paren:
+                self._next()
+            name = self._next()
+            if paren and self._next() != ')':
+                raise ValueError
+            if name not in self.macros and name not in self.undefined:
+                return None
+            return int(name in self.macros)
+        elif tok[0].isdigit():
+            return int(tok.rstrip('uUlL'), 0)
+        elif tok[0].isalpha() or tok[0] == '_':
+            if self._peek() == '(':
+                raise ValueError
+            if tok in self.undefined:
+                return 0
+            if not self.macros.get(tok, None):
+                return None
+            return _Expression(self.macros[tok], self.macros, self.undefined, self.depth + 1).evaluate()
+        raise ValueError
+
+def _apply(op, left, right):
+    if op == '&&':
+        if left == 0 or right == 0:
+            return 0
+        return None if left is None or right is None else 1
+    elif op == '||':
+        if (left is not None and left != 0) or (right is not None and right != 0):
+            return 1
+        return None if left is None or right is None else 0
+    if left is None or right is None:
+        return None
+    if op in ('/', '%') and right == 0:
+        return None
+    return {
+        '|': lambda: left | right, '^': lambda: left ^ right, '&': lambda: left & right,
+        '==': lambda: int(left == right), '!=': lambda: int(left != right),
+        '<': lambda: int(left < right), '>': lambda: int(left > right),
+        '<=': lambda: int(left <= right), '>=': lambda: int(left >= right),
+        '<<': lambda: left << right, '>>': lambda: left >> right,
+        '+': lambda: left + right, '-': lambda: left - right,
+        '*': lambda: left*right, '/': lambda: int(float(left)/right), '%': lambda: left % right,
+    }[op]()
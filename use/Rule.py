@@ -1,10 +1,15 @@
-import re, os
+import re, os, fnmatch
 from .Node import Node
 from .File import File
 from .conv import to_list
 import logging
 
-__all__ = ['Rule', 'RuleList']
+try:
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+__all__ = ['Rule', 'RuleList', 'match_sources']
 
 class RuleList(object):
 
@@ -80,6 +85,17 @@ class Rule(object):
     def __ne__(self, op):
         return not self.__eq__(op)
 
+    ##
+    ## Nodes are found and expanded again each run, so leave them out
+    ## of the stored configuration.
+    ##
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_src_nodes'] = []
+        state['product_nodes'] = []
+        state['productions'] = []
+        return state
+
     @property
     def source_nodes(self):
         if isinstance(self.source, Rule):
@@ -101,14 +117,18 @@ class Rule(object):
         return RuleList(self, op)
 
     ##
-    ## Scan for files.
+    ## Scan for files. Files already matched against each source
+    ## expression may be given, saving a walk.
     ##
-    def find_sources(self, ctx):
+    def find_sources(self, ctx, found=None):
         logging.debug('Rule: Looking at source %s'%repr(self.source))
 
         # If our source is a string then locate any matching files.
         if isinstance(self.source, basestring):
-            files = self.match_sources(self.source)
+            if found is not None and self.source in found:
+                files = found[self.source]
+            else:
+                files = self.match_sources(self.source)
             self._src_nodes = [ctx.file(f) for f in files]
 
     def scan(self, ctx):
@@ -146,7 +166,7 @@ class Rule(object):
             # product nodes and update product nodes with rules.
             for srcs, bldr, dsts in self.productions:
                 for src in srcs:
-                    src.products.extend(dsts)
+                    src.add_products(dsts)
                     assert src not in dsts, 'A production rule has resulted in a product that depends on itself: %s'%(str(self))
                 for dst in dsts:
                     dst.rule = self
@@ -155,24 +175,143 @@ class Rule(object):
         logging.debug('Rule: Done expanding rule.')
 
     def match_sources(self, expr):
-        logging.debug('Rule: Matching files.')
-
-        # Compile the regular expression.
-        prog = re.compile(expr)
-
-        # Scan everything.
-        srcs = []
-        for dir_path, dir_names, file_names in os.walk('.', followlinks=True):
-            for fn in file_names:
-                path = os.path.join(dir_path, fn)
-                path = path[2:]
-                match = prog.match(path)
-                if match:
-                    try:
-                        with open(path, 'r') as file:
-                            srcs.append(path)
-                    except:
-                        pass
-
-        logging.debug('Rule: Found %s'%srcs)
-        return srcs
+        return match_sources([expr])[expr]
+
+# Expressions that can't share a pattern with others, as they refer to
+# their own groups or set flags.
+private_prog = re.compile(r'\\[1-9]|\(\?P=|\(\?[iLmsux]')
+
+##
+## Match the files under the current directory against each of the
+## expressions, all in one walk. Paths that no expression matches are
+## rejected by a single combined pattern. Returns the matching paths
+## for each expression.
+##
+## Each expression only sees the directories its literal prefix can
+## reach. Below its prefix it also skips directories whose name or path
+## matches an ignored pattern, and those whose path matches an ignored
+## path exactly. Directories no expression sees aren't walked.
+##
+def match_sources(exprs, ignored=(), ignored_paths=()):
+    logging.debug('Rule: Matching files.')
+    progs = [(e, re.compile(e)) for e in set(exprs)]
+    found = dict((e, []) for e, p in progs)
+    shared = [(e, p) for e, p in progs if not private_prog.search(e)]
+    private = [(e, p) for e, p in progs if private_prog.search(e)]
+    try:
+        any_prog = re.compile('|'.join('(?:%s)'%e for e, p in shared)) if shared else None
+    except (re.error, AssertionError, OverflowError):
+        any_prog = None
+        private = progs
+    prefixes = dict((e, literal_dir(e)) for e, p in progs)
+
+    # The expressions that see each directory walked so far. A directory
+    # is seen by those that see its parent and either lead towards their
+    # prefix through it, or are below their prefix and don't ignore it.
+    seen = {'.': set(e for e, p in progs)}
+    def descend(path):
+        parent, name = os.path.split(path)
+        exprs = set()
+        for expr in seen[parent or '.']:
+            pre = prefixes[expr]
+            if pre == path or pre.startswith(path + '/'):
+                exprs.add(expr)
+            elif not pre or path.startswith(pre + '/'):
+                if not _ignored(path, name, ignored, ignored_paths):
+                    exprs.add(expr)
+        seen[path] = exprs
+        return len(exprs) > 0
+
+    for path in walk_files(descend):
+        exprs = seen[os.path.dirname(path) or '.']
+        cands = progs if any_prog is not None and any_prog.match(path) else private
+        for expr, prog in cands:
+            if expr in exprs and prog.match(path):
+                found[expr].append(path)
+    logging.debug('Rule: Found %s'%found)
+    return found
+
+def _ignored(path, name, patterns, paths):
+    if any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in patterns):
+        return True
+    return any(fnmatch.fnmatch(path, p) for p in paths)
+
+##
+## The directory every path an expression matches must be in, from the
+## literal text it starts with. Empty if the expression could match
+## anywhere.
+##
+def literal_dir(expr):
+    if '|' in expr:
+        return ''
+    chars = []
+    ii = 1 if expr.startswith('^') else 0
+    while ii < len(expr):
+        if expr[ii] == '\\':
+            if ii + 1 == len(expr) or expr[ii + 1].isalnum():
+                break
+            char, ii = expr[ii + 1], ii + 2
+        elif expr[ii] in '.^$*+?{}[]()':
+            break
+        else:
+            char, ii = expr[ii], ii + 1
+
+        # A repeated character may be left out, or be the last one known.
+        if ii < len(expr) and expr[ii] in '*?{':
+            break
+        chars.append(char)
+        if ii < len(expr) and expr[ii] == '+':
+            break
+    prefix = ''.join(chars)
+    return prefix[:prefix.rfind('/')] if '/' in prefix else ''
+
+##
+## Paths of the files below the current directory, relative to it, in
+## the order os.walk would give them. Symbolic links are followed, but
+## a link back to a directory already being walked is not. Directories
+## are only entered if descend gives True for their path.
+##
+def walk_files(descend=None):
+    try:
+        st = os.stat('.')
+    except OSError:
+        return
+    pending = [('.', frozenset([(st.st_dev, st.st_ino)]))]
+    while pending:
+        dir_path, parents = pending.pop()
+        dirs = []
+        for name, is_dir, is_file in _list_dir(dir_path):
+            path = name if dir_path == '.' else os.path.join(dir_path, name)
+            if is_dir:
+                if descend is not None and not descend(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                key = (st.st_dev, st.st_ino)
+                if key in parents:
+                    logging.debug('Rule: Not following link loop at %s'%path)
+                    continue
+                dirs.append((path, parents | frozenset([key])))
+            elif is_file:
+                yield path
+        pending.extend(reversed(dirs))
+
+##
+## Name and type of each entry in a directory. scandir gives the types
+## without a stat call per entry where it can.
+##
+def _list_dir(dir_path):
+    try:
+        if scandir is not None:
+            return [(e.name, e.is_dir(), e.is_file()) for e in scandir(dir_path)]
+        names = os.listdir(dir_path)
+    except OSError:
+        return []
+    entries = []
+    for name in names:
+        path = os.path.join(dir_path, name)
+        is_dir = os.path.isdir(path)
+        entries.append((name, is_dir, not is_dir and os.path.isfile(path)))
+    return entries
@@ -1,82 +1,347 @@
-import os, re
+import os, re, logging
 from Platform import platform
 from File import File
+from Action import Command
+from utils import ProcessPool, run_command
+from Preprocessor import read_directives, included_names, macro_definitions, define_prog
 
 class Scanner(object):
 
     def __init__(self, ctx):
         self.ctx = ctx
 
-class CScanner(Scanner):
+    ##
+    ## What the dependencies found for a node depend on, other than the
+    ## node itself. A node is scanned once for each key, so by default
+    ## once for each distinct builder.
+    ##
+    def key(self, bldr):
+        return ('builder', bldr.signature())
 
-    hdr_re = r'#\s*include\s*(?:<([^>]*)>|"([^"]*)")'
-    hdr_prog = re.compile(hdr_re)
+dep_prog = re.compile(r'(?:\\.|[^\s\\])+')
 
-    def find_all(self, node, data, bldr):
-        for n in self._find_all_headers(node, data, bldr, None):
-            yield n
-        for n in self._find_all_libraries(node, data, bldr):
-            yield n
+##
+## Paths a make style dependency file, as written by "-MMD -MF", lists
+## for its target. None if the file can't be read.
+##
+def read_dependency_file(path):
+    try:
+        with open(path, 'r') as dep_file:
+            data = dep_file.read().replace('\\\n', ' ')
+    except IOError:
+        return None
+    match = re.search(r':(?:\s|$)', data)
+    if match is None:
+        return None
+    deps = data[match.end():].split('\n', 1)[0]
+    return [os.path.normpath(p.replace('\\ ', ' ').replace('$$', '$')) for p in dep_prog.findall(deps)]
+
+##
+## Include relationships found while scanning, shared by all scanners
+## in a run. Each file is read at most once. The headers each node
+## includes, and the full set of headers reachable from it, are kept
+## for each set of header directories and macro definitions.
+##
+class IncludeGraph(object):
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self._directives = {}
+        self._names = {}
+        self._resolved = {}
+        self._misses = set()
+        self._listings = {}
+        self._direct = {}
+        self._closures = {}
+        self._partial = {}
+        self._predefined = {}
+
+    ##
+    ## Forget what was learnt from the given files.
+    ##
+    def forget(self, paths):
+        for path in paths:
+            self._directives.pop(self.ctx.norm_path(path), None)
+        self._names = {}
+        self._resolved = {}
+        self._misses = set()
+        self._listings = {}
+        self._direct = {}
+        self._closures = {}
+        self._partial = {}
+
+    ##
+    ## Names of the headers a node's file includes, given the macros
+    ## defined. With no macros every include is given.
+    ##
+    def names(self, node, defines=None):
+        key = (str(node), defines)
+        names = self._names.get(key, None)
+        if names is None:
+            names = included_names(self.directives(node), defines)
+            self._names[key] = names
+        return names
+
+    ##
+    ## The preprocessor directives of a node's file. They are stored
+    ## with the file's stat signature, so the file is only read when it
+    ## has changed since an earlier run, and then only once in this run.
+    ##
+    def directives(self, node):
+        dirs = self._directives.get(str(node), None)
+        if dirs is None:
+            stat, dirs = self._stored(node)
+            if dirs is None:
+                dirs = read_directives(str(node))
+                self._store(node, stat, dirs)
+        return dirs
 
-    def _find_all_headers(self, node, data, bldr, found):
-        if found is None:
-            found = set()
-        for hdr in re.findall(self.hdr_prog, data):
-            hdr = hdr[0] or hdr[1]
+    ##
+    ## Make sure the directives of each node are known, reading the
+    ## files that have changed in a pool of processes.
+    ##
+    def load(self, nodes, pool):
+        stale = {}
+        for node in nodes:
+            if str(node) in self._directives or str(node) in stale:
+                continue
+            stat, dirs = self._stored(node)
+            if dirs is None:
+                stale[str(node)] = (node, stat)
+        if stale:
+            logging.debug('IncludeGraph: Reading %d files.'%len(stale))
+            paths = list(stale.iterkeys())
+            for path, dirs in zip(paths, pool.map(read_directives, paths)):
+                node, stat = stale[path]
+                self._store(node, stat, dirs)
 
-            # Must be able to locate the header somewhere on
-            # the filesystem. Start locally.
-            node_base = os.path.dirname(str(node))
+    ##
+    ## Load every file the scan of the given (node, header dirs) pairs
+    ## will need, one level of includes at a time, so the scan itself
+    ## reads nothing. Every include is followed, so this covers scans
+    ## with any macros defined. The same pool of processes is used for
+    ## every level.
+    ##
+    def prefetch(self, pairs, num_procs=1):
+        pool = ProcessPool(num_procs)
+        try:
+            self.load([n for n, d in pairs], pool)
+            level = set()
+            for node, hdr_dirs in pairs:
+                for hdr in self.names(node):
+                    cur_node = self.resolve(node, hdr, hdr_dirs)
+                    if cur_node is not None:
+                        level.add((cur_node, hdr_dirs))
+            done = set()
+            while level:
+                done.update(level)
+                srcs = []
+                for node, hdr_dirs in level:
+                    srcs.extend(node.builder.sources if node.builder is not None else [node])
+                self.load(srcs, pool)
+                level = set((n, d) for node, d in level for n in self.direct(node, d)) - done
+        finally:
+            pool.close()
+
+    ##
+    ## The stat signature of a node's file, and the directives stored
+    ## with it if they are still current.
+    ##
+    def _stored(self, node):
+        stat = node._stat_file(str(node))
+        cached = self.ctx.state.includes.get(node.id) if node.id is not None else None
+        if stat is not None and cached is not None and cached[0] == stat:
+            self._directives[str(node)] = cached[1]
+            return stat, cached[1]
+        return stat, None
+
+    def _store(self, node, stat, dirs):
+        if stat is not None and node.id is not None:
+            self.ctx.state.includes[node.id] = (stat, dirs)
+        self._directives[str(node)] = dirs
+
+    ##
+    ## Locate a header included from a node. Look beside the node
+    ## first, then in each header directory.
+    ##
+    def resolve(self, node, hdr, hdr_dirs):
+        node_base = os.path.dirname(str(node))
+        key = (node_base, hdr, hdr_dirs)
+        cur_node = self._resolved.get(key, None)
+        if cur_node is None:
             path = os.path.join(node_base, hdr)
             cur_node = self.ctx.find_node(path)
+            if cur_node is None:
+                if self._exists(path):
+                    cur_node = self.ctx.file(path)
+                else:
+                    cur_node = self._search(hdr, hdr_dirs)
             if cur_node is not None:
-                if cur_node in found:
-                    continue
-                yield cur_node
-            elif os.path.exists(path):
+                self._resolved[key] = cur_node
+        return cur_node
+
+    ##
+    ## Find a header in the header directories, as a node to be built
+    ## or an existing file. Misses are remembered until forgotten, so
+    ## headers outside the build, like system headers, are only
+    ## searched for once.
+    ##
+    def _search(self, hdr, hdr_dirs):
+        key = (hdr, hdr_dirs)
+        if key in self._misses:
+            return None
+        for hdr_dir in hdr_dirs:
+            path = os.path.join(hdr_dir, hdr)
+            cur_node = self.ctx.find_node(path)
+            if cur_node is None and self._exists(path):
                 cur_node = self.ctx.file(path)
-                if cur_node in found:
-                    continue
-                yield cur_node
+            if cur_node is not None:
+                return cur_node
+        self._misses.add(key)
+        return None
+
+    ##
+    ## Does a path exist? Each directory is listed once, when first
+    ## needed, rather than each path being checked.
+    ##
+    def _exists(self, path):
+        dir_path, name = os.path.split(path)
+        listing = self._listings.get(dir_path, None)
+        if listing is None:
+            try:
+                listing = set(os.listdir(dir_path or '.'))
+            except OSError:
+                listing = set()
+            self._listings[dir_path] = listing
+        return name in listing
+
+    ##
+    ## Headers a node includes directly. If the node has sources its
+    ## includes are read from those instead.
+    ##
+    def direct(self, node, hdr_dirs, defines=None):
+        key = (node, hdr_dirs, defines)
+        nodes = self._direct.get(key, None)
+        if nodes is None:
+            nodes = []
+            srcs = node.builder.sources if node.builder is not None else [node]
+            for src in srcs:
+                for hdr in self.names(src, defines):
+                    cur_node = self.resolve(node, hdr, hdr_dirs)
+                    if cur_node is not None and cur_node not in nodes:
+                        nodes.append(cur_node)
+            self._direct[key] = nodes
+        return nodes
 
-            # Next try all header dirs.
+    ##
+    ## Macros a compiler defines before reading any file, such as
+    ## "__linux__" or "__cplusplus", as found with "-dM -E". Each
+    ## compiler is only run once for each language. Empty if it can't
+    ## be run.
+    ##
+    def predefined(self, binary, lang):
+        key = (binary, lang)
+        macros = self._predefined.get(key, None)
+        if macros is None:
+            macros = {}
+            try:
+                code, stdout, stderr = run_command('%s -dM -E -x %s %s'%(binary, lang, os.devnull))
+            except OSError:
+                code = None
+            if code == 0:
+                for line in stdout.splitlines():
+                    if line.startswith('#define '):
+                        match = define_prog.match(line[8:])
+                        if match is not None:
+                            macros[match.group(1)] = None if match.group(2) else match.group(3)
             else:
-                for hdr_dir in bldr.options.get('header_dirs', []):
-                    path = os.path.join(hdr_dir, hdr)
-                    cur_node = self.ctx.find_node(path)
-                    if cur_node is not None:
-                        if cur_node in found:
-                            cur_node = None
-                            break
-                        yield cur_node
-                        break
+                logging.debug('IncludeGraph: Unable to find macros predefined by ' + binary + '.')
+            self._predefined[key] = macros
+        return macros
 
-            # If we found it, rip out all the headers in THIS header
-            # too.
-            if cur_node is not None:
+    ##
+    ## Every header reachable from a node, in depth first order.
+    ##
+    def closure(self, node, hdr_dirs, defines=None):
+        key = (node, hdr_dirs, defines)
+        if key not in self._closures:
+            self._closure(node, hdr_dirs, defines, set())
+        return self._closures[key]
 
-                # Add to the found set.
-                found.add(cur_node)
+    ##
+    ## Closures found while another node in the same include cycle is
+    ## still being visited are incomplete, so are only kept once the
+    ## first node of the cycle is done. Returns the nodes still being
+    ## visited that were reached.
+    ##
+    def _closure(self, node, hdr_dirs, defines, visiting):
+        visiting.add(node)
+        result = []
+        seen = set([node])
+        pending = set()
+        for cur_node in self.direct(node, hdr_dirs, defines):
+            if cur_node in seen:
+                continue
+            seen.add(cur_node)
+            result.append(cur_node)
+            key = (cur_node, hdr_dirs, defines)
+            if key in self._closures:
+                sub = self._closures[key]
+            elif cur_node in visiting:
+                pending.add(cur_node)
+                continue
+            else:
+                pending.update(self._closure(cur_node, hdr_dirs, defines, visiting))
+                sub = self._closures.get(key, None)
+                if sub is None:
+                    sub = self._partial.pop(key)
+            for n in sub:
+                if n not in seen:
+                    seen.add(n)
+                    result.append(n)
+        visiting.remove(node)
+        pending.discard(node)
+        if pending:
+            self._partial[(node, hdr_dirs, defines)] = result
+        else:
+            self._closures[(node, hdr_dirs, defines)] = result
+        return pending
 
-                # If the node has sources, scan those instead.
-                if cur_node.builder is not None:
-                    srcs = cur_node.builder.sources
-                else:
-                    srcs = [cur_node]
-
-                # Scan sub-headers of existing sources.
-                for src in srcs:
-                    hdr_data = None
-                    try:
-                        with open(str(src), 'r') as hdr_file:
-                            hdr_data = hdr_file.read()
-                    except IOError:
-                        pass
-                    if hdr_data is not None:
-                        for f in self._find_all_headers(cur_node, hdr_data, bldr, found):
-                            yield f
-
-    def _find_all_libraries(self, node, data, bldr):
+class CScanner(Scanner):
+
+    def key(self, bldr):
+        opts = bldr.options
+        return (tuple(opts.get('header_dirs', [])), repr(opts.get('define', [])),
+                repr(opts.get('libraries', [])), repr(opts.get('library_dirs', [])), 'compile' in opts)
+
+    def find_all(self, node, bldr):
+        for n in self._find_all_headers(node, bldr):
+            yield n
+        for n in self._find_all_libraries(node, bldr):
+            yield n
+
+    def _find_all_headers(self, node, bldr):
+        includes = self.ctx.includes
+        hdr_dirs = tuple(bldr.options.get('header_dirs', []))
+        defines = self.defines(node, bldr)
+        found = set()
+        for hdr in includes.names(node, defines):
+            cur_node = includes.resolve(node, hdr, hdr_dirs)
+            if cur_node is None:
+                continue
+            for n in [cur_node] + includes.closure(cur_node, hdr_dirs, defines):
+                if n not in found:
+                    found.add(n)
+                    yield n
+
+    ##
+    ## Macros to evaluate conditional includes with. None follows
+    ## every include.
+    ##
+    def defines(self, node, bldr):
+        return None
+
+    def _find_all_libraries(self, node, bldr):
 
         # Don't try this if we are compiling.
         if 'compile' in bldr.options:
@@ -94,3 +359,37 @@ class CScanner(Scanner):
                     if cur_node is not None:
                         yield cur_node
                         break
+
+##
+## A C scanner that only follows includes the preprocessor would reach,
+## evaluating conditionals with the macros the builder's compiler
+## predefines and its "define" option. Macros defined in other headers
+## aren't seen, so conditions on them keep both branches.
+##
+class CPreprocessorScanner(CScanner):
+
+    def __init__(self, ctx):
+        super(CPreprocessorScanner, self).__init__(ctx)
+        self._defines = {}
+
+    def defines(self, node, bldr):
+        compiler = self.compiler(node, bldr)
+        option = bldr.options.get('define', [])
+        key = (compiler, repr(option))
+        defines = self._defines.get(key, None)
+        if defines is None:
+            predefined = self.ctx.includes.predefined(*compiler) if compiler is not None else None
+            defines = macro_definitions(option, predefined)
+            self._defines[key] = defines
+        return defines
+
+    ##
+    ## The compiler of the builder's first command and the language to
+    ## run it with for a source. None if the builder has no command.
+    ##
+    def compiler(self, node, bldr):
+        for action in getattr(bldr, 'actions', []):
+            if isinstance(action, Command) and action.binary is not None:
+                lang = 'c' if os.path.splitext(str(node))[1] == '.c' else 'c++'
+                return (str(action.binary), lang)
+        return None
@@ -0,0 +1,298 @@
+import sys, time, threading, heapq, itertools, logging
+from array import array
+from .Action import CommandFailed
+from .CompactGraph import CompactGraph
+
+##
+## Dependency counting job scheduler. Each node reachable from the
+## targets is given a count of its outstanding inputs (builder sources
+## and scanned dependencies). Nodes with no outstanding inputs sit on a
+## ready queue. When a job completes the counts of its dependents are
+## decremented, pushing any that reach zero onto the ready queue. This
+## keeps the total dispatch cost at O(V+E) for the whole build.
+##
+## The ready queue is ordered by the estimated length of the path from
+## each node to a target, using the durations recorded on previous runs,
+## so long chains (such as links) are started as early as possible.
+##
+## The graph is frozen into a CompactGraph first, and all bookkeeping
+## is done in arrays indexed by node position in it.
+##
+## When keeping going, a failed node and everything downstream of it are
+## flagged as blocked and the remaining jobs continue to run.
+##
+## Rather than counting threads, each job takes a number of CPU tokens
+## (its builder's weight) and an amount of memory from a budget. A job
+## is only dispatched when its resources are free; lighter ready jobs
+## may be dispatched ahead of a heavier one that does not fit. With a
+## jobserver the CPU tokens are also taken from its pipe, so makes run
+## by our commands draw from the same budget. Pipe tokens are only taken
+## while a builder runs, not for sources or nodes found up to date.
+##
+class Scheduler(object):
+
+    def __init__(self, ctx, num_threads=1, keep_going=False, trace=None, memory=None, jobserver=None):
+        self.ctx = ctx
+        self.num_threads = max(num_threads or 1, 1)
+        self.keep_going = keep_going
+        self.trace = trace
+        self.memory = memory
+        self.jobserver = jobserver
+        self._free_cpus = self.num_threads
+        self._implicit = True
+        self._free_memory = memory
+        self.failures = []
+        self._cond = threading.Condition()
+        self._ready = []
+        self._targets = []
+        self.graph = None
+        self.nodes = []
+        self._remaining = array('l')
+        self._priority = array('d')
+        self._counter = itertools.count()
+        self._num_nodes = 0
+        self._num_done = 0
+        self._num_running = 0
+        self._finished = False
+        self._stopping = False
+        self._error = None
+
+    ##
+    ## Collect all nodes needed to build the targets.
+    ##
+    def add_targets(self, targets):
+        logging.debug('Scheduler: Adding targets: ' + str(targets))
+        self._targets.extend(targets)
+        self.graph = CompactGraph(self._targets)
+        self.nodes = self.graph.nodes
+        self._num_nodes = len(self.nodes)
+        self._remaining = array('l', (self.graph.num_inputs(i) for i in xrange(self._num_nodes)))
+
+        # Flag the nodes as part of this build.
+        for node in self.nodes:
+            node.seen = True
+        logging.debug('Scheduler: Have %d nodes.'%self._num_nodes)
+
+    ##
+    ## Run all jobs. With a single thread jobs are processed
+    ## on the calling thread.
+    ##
+    def run(self):
+        logging.debug('Scheduler: Running with %d threads.'%self.num_threads)
+        self._prioritise()
+        if self.graph is not None:
+            for idx in self.graph.leaves():
+                self._push(idx)
+        if not self._ready:
+            self._finished = True
+        if self.num_threads == 1:
+            self._worker(0)
+        else:
+            workers = []
+            for slot in range(self.num_threads):
+                thr = threading.Thread(target=self._worker, args=(slot,))
+                thr.daemon = True
+                thr.start()
+                workers.append(thr)
+
+            # Wait with a timeout so signals can still be handled
+            # on the main thread.
+            for thr in workers:
+                while thr.is_alive():
+                    thr.join(0.1)
+
+        # Propagate any unexpected errors from the workers.
+        if self._error is not None:
+            exc = self._error
+            self._error = None
+            raise exc[0], exc[1], exc[2]
+
+        # Any nodes not processed are part of a cycle.
+        if self.failures:
+            return False
+        if not self._stopping and self._num_done < self._num_nodes:
+            sys.stdout.write('\nUnable to build %d nodes, there is a cycle in the dependencies.\n'%(self._num_nodes - self._num_done))
+            return False
+        logging.debug('Scheduler: Done running.')
+        return not self._stopping
+
+    ##
+    ## Stop dispatching new jobs. Jobs already running will
+    ## complete.
+    ##
+    def stop(self):
+        logging.debug('Scheduler: Stopping.')
+        with self._cond:
+            self._stopping = True
+            self._finished = True
+            self._cond.notify_all()
+
+    def _worker(self, slot):
+        while True:
+            with self._cond:
+                idx = None
+                while idx is None:
+                    if self._finished:
+                        return
+                    idx = self._pop_fitting()
+                    if idx is None:
+                        self._cond.wait()
+                node = self.nodes[idx]
+                cpus, memory = self._resources(node)
+                self._free_cpus -= cpus
+                if self._free_memory is not None:
+                    self._free_memory -= memory
+                self._num_running += 1
+
+            start = time.time()
+            okay = self._execute(node, _Tokens(self, cpus) if self.jobserver is not None else None)
+            if self.trace is not None:
+                self.trace.job(node, slot, start, time.time(), not okay)
+
+            with self._cond:
+                self._free_cpus += cpus
+                if self._free_memory is not None:
+                    self._free_memory += memory
+                self._num_running -= 1
+                if okay:
+                    self._complete(idx)
+                elif self.keep_going and self._error is None:
+                    self._block(idx)
+                else:
+                    self._stopping = True
+                if self._stopping or (not self._ready and not self._num_running):
+                    self._finished = True
+                self._cond.notify_all()
+
+    def _execute(self, node, tokens):
+        try:
+            okay = node.build_job(self.ctx, tokens)
+            if okay:
+                self.ctx.journal_node(node)
+            return okay
+        except CommandFailed as ex:
+            with self._cond:
+                self.failures.append((node, ex))
+            return False
+        except:
+            self._error = sys.exc_info()
+            return False
+
+    ##
+    ## Take a job's CPU tokens from the jobserver. The first job to
+    ## take any holds the implicit token in place of one from the
+    ## pipe.
+    ##
+    def _acquire(self, cpus):
+        with self._cond:
+            implicit = self._implicit
+            self._implicit = False
+        return implicit, self.jobserver.acquire(cpus - 1 if implicit else cpus)
+
+    def _release(self, implicit, tokens):
+        self.jobserver.release(tokens)
+        if implicit:
+            with self._cond:
+                self._implicit = True
+
+    def _complete(self, idx):
+        self._num_done += 1
+        for dep in self.graph.outputs(idx):
+            if self.nodes[dep]._blocked:
+                continue
+            self._remaining[dep] -= 1
+            if not self._remaining[dep]:
+                self._push(dep)
+
+    ##
+    ## Flag a failed node and everything downstream of it as
+    ## blocked. Blocked nodes count as done.
+    ##
+    def _block(self, idx):
+        logging.debug('Scheduler: Blocking: ' + str(self.nodes[idx]))
+        self.nodes[idx]._blocked = True
+        stack = [idx]
+        while stack:
+            cur = stack.pop()
+            self._num_done += 1
+            for dep in self.graph.outputs(cur):
+                if not self.nodes[dep]._blocked:
+                    self.nodes[dep]._blocked = True
+                    stack.append(dep)
+
+    ##
+    ## Pop the highest priority ready node whose resources are
+    ## available, leaving the others on the queue.
+    ##
+    def _pop_fitting(self):
+        skipped = []
+        idx = None
+        while self._ready:
+            item = heapq.heappop(self._ready)
+            cpus, memory = self._resources(self.nodes[item[2]])
+            if cpus <= self._free_cpus and (self._free_memory is None or memory <= self._free_memory):
+                idx = item[2]
+                break
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self._ready, item)
+        return idx
+
+    ##
+    ## The CPU tokens and memory a node's job needs. Requirements are
+    ## clamped to the totals so any job can run on its own.
+    ##
+    def _resources(self, node):
+        if node.builder is None:
+            return 1, 0
+        cpus = min(max(node.builder.weight, 1), self.num_threads)
+        memory = node.builder.memory
+        if self.memory is not None:
+            memory = min(memory, self.memory)
+        return cpus, memory
+
+    def _push(self, idx):
+        heapq.heappush(self._ready, (-self._priority[idx], next(self._counter), idx))
+
+    ##
+    ## Calculate the longest estimated path from each node to a
+    ## target, accumulating over the nodes in reverse topological
+    ## order.
+    ##
+    def _prioritise(self):
+        logging.debug('Scheduler: Calculating priorities.')
+        self._priority = array('d', [0.0])*self._num_nodes
+        if self.graph is None:
+            return
+
+        # Nodes without a recorded duration get the average.
+        durations = [self.ctx.node_duration(n) for n in self.nodes]
+        known = [d for d in durations if d is not None]
+        default = sum(known)/len(known) if known else 1.0
+
+        for idx in reversed(self.graph.topological_order()):
+            cost = durations[idx]
+            if cost is None:
+                cost = default if self.nodes[idx].builder is not None else 0.0
+            longest = 0.0
+            for dep in self.graph.outputs(idx):
+                longest = max(longest, self._priority[dep])
+            self._priority[idx] = cost + longest
+
+##
+## The jobserver tokens of a job, held while its builder runs.
+##
+class _Tokens(object):
+
+    def __init__(self, scheduler, cpus):
+        self.scheduler = scheduler
+        self.cpus = cpus
+        self.held = None
+
+    def __enter__(self):
+        self.held = self.scheduler._acquire(self.cpus)
+        return self
+
+    def __exit__(self, *exc):
+        self.scheduler._release(*self.held)
+        self.held = None
@@ -0,0 +1,316 @@
+import os, struct, sqlite3, pickle, threading, logging
+
+__all__ = ['State']
+
+##
+## A table of values keyed by node ID. The table is read in full the
+## first time it is needed, and only rows that have changed are written
+## back.
+##
+class Table(object):
+
+    def __init__(self, state, name):
+        self.state = state
+        self.name = name
+        self._rows = None
+        self._dirty = set()
+        self._cleared = False
+
+    def get(self, key, default=None):
+        return self._load().get(key, default)
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __contains__(self, key):
+        return key in self._load()
+
+    def __len__(self):
+        return len(self._load())
+
+    def __setitem__(self, key, value):
+        rows = self._load()
+        if key not in rows or rows[key] != value:
+            rows[key] = value
+            self._dirty.add(key)
+
+    def pop(self, key, default=None):
+        rows = self._load()
+        if key in rows:
+            self._dirty.add(key)
+            return rows.pop(key)
+        return default
+
+    ##
+    ## The row for a key if it has changed since the last flush. Gives
+    ## None for unchanged rows and (key, None) for removed ones.
+    ##
+    def changed(self, key):
+        if key not in self._dirty:
+            return None
+        rows = self._rows or {}
+        return (key, rows[key]) if key in rows else (key, None)
+
+    def clear(self):
+        self._rows = {}
+        self._dirty = set()
+        self._cleared = True
+
+    def flush(self, conn):
+        if self._cleared:
+            conn.execute('DELETE FROM %s'%self.name)
+            self._cleared = False
+        rows = self._rows or {}
+        for key in self._dirty:
+            if key in rows:
+                conn.execute('INSERT OR REPLACE INTO %s (id, value) VALUES (?, ?)'%self.name,
+                             (key, self.state.encode(rows[key])))
+            else:
+                conn.execute('DELETE FROM %s WHERE id = ?'%self.name, (key,))
+        self._dirty = set()
+
+    def _load(self):
+        if self._rows is None:
+            with self.state.lock:
+                if self._rows is None:
+                    rows = {}
+                    if self.state.exists():
+                        for key, value in self.state.connect().execute('SELECT id, value FROM %s'%self.name):
+                            rows[key] = self.state.decode(value)
+                    logging.debug('State: Loaded %d rows from %s.'%(len(rows), self.name))
+                    self._rows = rows
+        return self._rows
+
+##
+## Persistent build state, kept in an SQLite database. Configuration is
+## stored as a single row, separately from the per-node tables, so each
+## can be read and updated without the others. Nodes are given dense
+## integer IDs that are kept from run to run, and the per-node tables
+## are keyed by these.
+##
+## Rows changed by each job that ran are also appended to a journal, so
+## the work survives the process being killed before the state is
+## saved. Jobs finishing together share a single sync of the journal.
+## The journal is replayed into the database the next time it is opened
+## and removed once the database is saved.
+##
+class State(object):
+
+    tables = ['crcs', 'source_crcs', 'stats', 'durations', 'builders', 'includes', 'dependencies']
+    header = 'SQLite format 3\0'
+    version = 4
+
+    def __init__(self, path='.use.db'):
+        self.path = path
+        self.journal_path = path + '.log'
+        self.lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._conn = None
+        self._journal = None
+        self._written = 0
+        self._synced = 0
+        self._ids = None
+        self._new_ids = []
+        self._unjournaled_ids = []
+        self._clear_ids = False
+        for name in self.tables:
+            setattr(self, name, Table(self, name))
+
+    ##
+    ## Is there a usable state file? Files from older versions of
+    ## use are not.
+    ##
+    def exists(self):
+        if self._conn is not None:
+            return True
+        return self._current()
+
+    def _current(self):
+        try:
+            with open(self.path, 'rb') as inf:
+                if inf.read(len(self.header)) != self.header:
+                    return False
+        except IOError:
+            return False
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('PRAGMA user_version').fetchone()[0] == self.version
+        finally:
+            conn.close()
+
+    ##
+    ## The ID of the named node, assigning the next free one if the
+    ## node is new.
+    ##
+    def node_id(self, name):
+        with self.lock:
+            if self._ids is None:
+                self._ids = {}
+                if self.exists():
+                    for key, nid in self.connect().execute('SELECT name, id FROM names'):
+                        self._ids[key] = nid
+                self._next_id = max(self._ids.itervalues()) + 1 if self._ids else 0
+            nid = self._ids.get(name)
+            if nid is None:
+                nid = self._next_id
+                self._next_id += 1
+                self._ids[name] = nid
+                self._new_ids.append(name)
+                self._unjournaled_ids.append(name)
+            return nid
+
+    def connect(self):
+        with self.lock:
+            if self._conn is None:
+                if os.path.exists(self.path) and not self._current():
+                    logging.debug('State: Replacing old state file.')
+                    os.remove(self.path)
+                self._conn = sqlite3.connect(self.path, check_same_thread=False)
+                self._conn.text_factory = str
+                self._conn.execute('CREATE TABLE IF NOT EXISTS config (name TEXT PRIMARY KEY, value BLOB)')
+                self._conn.execute('CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, id INTEGER UNIQUE)')
+                for name in self.tables:
+                    self._conn.execute('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, value BLOB)'%name)
+                if self._conn.execute('PRAGMA user_version').fetchone()[0] != self.version:
+                    self._conn.execute('PRAGMA user_version = %d'%self.version)
+                self._conn.commit()
+                self._replay()
+        return self._conn
+
+    def close(self):
+        with self.lock:
+            self._close_journal()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    ##
+    ## Append the rows changed for a key to the journal, and make
+    ## sure they reach the disk. Only one thread syncs at a time, and
+    ## each sync covers every entry written before it started, so
+    ## threads waiting on it often find their entry already synced.
+    ##
+    def record(self, key):
+        entry = []
+        for name in self.tables:
+            row = getattr(self, name).changed(key)
+            if row is not None:
+                entry.append((name,) + row)
+        if not entry:
+            return
+        with self.lock:
+
+            # Rows can't be replayed without the IDs they are keyed by.
+            entry = [('names', n, self._ids[n]) for n in self._unjournaled_ids] + entry
+            self._unjournaled_ids = []
+            data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'ab')
+            self._journal.write(struct.pack('!I', len(data)) + data)
+            self._journal.flush()
+            self._written += 1
+            entry_num = self._written
+            journal = self._journal
+        with self._sync_lock:
+            if self._synced < entry_num:
+                with self.lock:
+                    written = self._written
+                getattr(os, 'fdatasync', os.fsync)(journal.fileno())
+                self._synced = written
+
+    ##
+    ## Load a config row: the pickled context from the last configure,
+    ## or the arguments from the last run.
+    ##
+    def load_config(self, name='context'):
+        if not self.exists():
+            return None
+        with self.lock:
+            row = self.connect().execute('SELECT value FROM config WHERE name = ?', (name,)).fetchone()
+        return self.decode(row[0]) if row is not None else None
+
+    ##
+    ## Write the configuration and arguments, if given, and any changed
+    ## rows in a single transaction.
+    ##
+    def save(self, config=None, arguments=None):
+        with self.lock:
+            conn = self.connect()
+            with conn:
+                if config is not None:
+                    conn.execute('INSERT OR REPLACE INTO config (name, value) VALUES (?, ?)',
+                                 ('context', self.encode(config)))
+                if arguments is not None:
+                    conn.execute('INSERT OR REPLACE INTO config (name, value) VALUES (?, ?)',
+                                 ('arguments', self.encode(arguments)))
+                if self._clear_ids:
+                    conn.execute('DELETE FROM names')
+                    self._clear_ids = False
+                for name in self._new_ids:
+                    conn.execute('INSERT OR REPLACE INTO names (name, id) VALUES (?, ?)', (name, self._ids[name]))
+                self._new_ids = []
+                self._unjournaled_ids = []
+                for name in self.tables:
+                    getattr(self, name).flush(conn)
+            self._close_journal()
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+
+    ##
+    ## Clear the given tables, or everything including node IDs. IDs
+    ## must only be cleared before any nodes are made.
+    ##
+    def clear(self, names=None):
+        for name in (names if names is not None else self.tables):
+            getattr(self, name).clear()
+        if names is None:
+            with self.lock:
+                self._ids = {}
+                self._next_id = 0
+                self._new_ids = []
+                self._unjournaled_ids = []
+                self._clear_ids = True
+
+    ##
+    ## Apply any journal left by a previous run to the database, then
+    ## discard it. A partly written final entry is ignored.
+    ##
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return
+        count = 0
+        with open(self.journal_path, 'rb') as inf, self._conn:
+            while True:
+                header = inf.read(4)
+                if len(header) < 4:
+                    break
+                size = struct.unpack('!I', header)[0]
+                data = inf.read(size)
+                if len(data) < size:
+                    break
+                try:
+                    entry = pickle.loads(data)
+                except Exception:
+                    break
+                for name, key, value in entry:
+                    if name == 'names':
+                        self._conn.execute('INSERT OR REPLACE INTO names (name, id) VALUES (?, ?)', (key, value))
+                    elif value is None:
+                        self._conn.execute('DELETE FROM %s WHERE id = ?'%name, (key,))
+                    else:
+                        self._conn.execute('INSERT OR REPLACE INTO %s (id, value) VALUES (?, ?)'%name,
+                                           (key, self.encode(value)))
+                count += 1
+        os.remove(self.journal_path)
+        logging.debug('State: Replayed %d journal entries.'%count)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def encode(self, value):
+        return buffer(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+    def decode(self, value):
+        return pickle.loads(str(value))
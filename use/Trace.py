@@ -0,0 +1,60 @@
+import time, json, threading, logging
+from contextlib import contextmanager
+
+##
+## Records a timeline of the run in the trace event format understood
+## by chrome://tracing and Perfetto. Top level phases are placed on the
+## main thread track and each job on the track of its worker slot.
+##
+class Trace(object):
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, 'phase', 0, start, time.time())
+
+    def job(self, node, slot, start, end, failed=False):
+        cmds = []
+        if node.builder is not None:
+            try:
+                cmds = node.builder.command_strings()
+            except:
+                pass
+        args = {
+            'node': repr(node),
+            'command': ' && '.join(cmds),
+            'invalidated': bool(node._invalid),
+            'skipped': not node._invalid,
+            'failed': failed,
+        }
+        self.add(repr(node), 'job', slot + 1, start, end, args)
+
+    def add(self, name, cat, tid, start, end, args={}):
+        event = {
+            'name': name,
+            'cat': cat,
+            'ph': 'X',
+            'pid': 0,
+            'tid': tid,
+            'ts': int((start - self._start)*1e6),
+            'dur': int((end - start)*1e6),
+            'args': args,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def write(self, path):
+        logging.debug('Trace: Writing %d events to %s'%(len(self._events), path))
+        tids = sorted(set(e['tid'] for e in self._events))
+        meta = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': t,
+                 'args': {'name': 'main' if t == 0 else 'slot %d'%(t - 1)}} for t in tids]
+        with open(path, 'w') as out:
+            json.dump({'traceEvents': meta + self._events, 'displayTimeUnit': 'ms'}, out)
@@ -1,19 +1,28 @@
-import os, binascii
+import os
+from .Digest import file_digest, data_digest
 
 class Validatable(object):
+    __slots__ = ('_crc', '_new_crc', '_stat')
 
     def __init__(self):
         self._crc = None
         self._new_crc = None
+        self._stat = None
 
-    def set_valid_crc(self, filename):
-        self._crc = self._crc32_file(filename)
+    def set_valid_crc(self, filename, ctx):
+        self._crc = self._digest_file(filename, ctx)
 
-    def invalidated_crc(self, filename, ctx):
+    ##
+    ## Load the stored CRC and calculate the current one.
+    ##
+    def load_crc(self, filename, ctx):
         if self._crc is None:
             self._crc = ctx.node_crc(self)
         if self._new_crc is None:
-            self._new_crc = self._crc32_file(filename)
+            self._new_crc = self._digest_file_cached(filename, ctx)
+
+    def invalidated_crc(self, filename, ctx):
+        self.load_crc(filename, ctx)
         return self._crc is None or self._new_crc is None or self._new_crc != self._crc
 
     def current_crc(self, ctx):
@@ -21,11 +30,27 @@ class Validatable(object):
             self._crc = ctx.node_crc(self)
         return self._new_crc if self._new_crc is not None else self._crc
 
-    def _crc32_file(self, filename):
-        if os.path.exists(filename):
-            return binascii.crc32(open(filename, 'rb').read()) & 0xFFFFFFFF
-        else:
+    ##
+    ## Calculate the digest of a file, reusing the stored one if the
+    ## file's stat signature matches the one stored with it.
+    ##
+    def _digest_file_cached(self, filename, ctx):
+        self._stat = self._stat_file(filename)
+        if self._stat is None:
             return None
+        if self._crc is not None and self._stat == ctx.node_stat(self):
+            return self._crc
+        return self._digest_file(filename, ctx)
+
+    def _stat_file(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime, st.st_ino)
+
+    def _digest_file(self, filename, ctx):
+        return file_digest(filename, ctx.digest_type)
 
-    def _crc32(self, data):
-        return binascii.crc32(data) & 0xFFFFFFFF
+    def _digest(self, data, ctx):
+        return data_digest(data, ctx.digest_type)
@@ -0,0 +1,118 @@
+import os, sys, time, select, struct, ctypes, ctypes.util, logging
+
+##
+## Waits for changes to a set of files by polling the files' stat
+## signatures. Subclasses may use something better where available.
+##
+class Watcher(object):
+
+    def __init__(self, paths, interval=0.5):
+        self.interval = interval
+        self.paths = set()
+        self.update(paths)
+
+    def update(self, paths):
+        self.paths = set(os.path.abspath(p) for p in paths)
+        self._stats = dict((p, self._stat(p)) for p in self.paths)
+
+    ##
+    ## Block until at least one watched file changes, returning the
+    ## set of changed paths. Gives up with an empty set after the
+    ## timeout, if one is given.
+    ##
+    def wait(self, timeout=None):
+        end = time.time() + timeout if timeout is not None else None
+        while True:
+            time.sleep(self.interval)
+            changed = set()
+            for path in self.paths:
+                st = self._stat(path)
+                if st != self._stats.get(path):
+                    self._stats[path] = st
+                    changed.add(path)
+            if changed or (end is not None and time.time() >= end):
+                return changed
+
+    def close(self):
+        pass
+
+    def _stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime, st.st_ino)
+
+class InotifyWatcher(Watcher):
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    event_fmt = 'iIII'
+    event_size = struct.calcsize(event_fmt)
+
+    def __init__(self, paths, interval=0.1):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self._dirs = {}
+        super(InotifyWatcher, self).__init__(paths, interval)
+
+    ##
+    ## Watch directories rather than files, so editors that replace
+    ## files by renaming are still seen.
+    ##
+    def update(self, paths):
+        self.paths = set(os.path.abspath(p) for p in paths)
+        watched = set(self._dirs.itervalues())
+        for d in set(os.path.dirname(p) for p in self.paths):
+            if d not in watched:
+                wd = self._libc.inotify_add_watch(self._fd, d, self.MASK)
+                if wd >= 0:
+                    self._dirs[wd] = d
+                else:
+                    logging.debug('Watcher: Unable to watch ' + d)
+
+    def wait(self, timeout=None):
+        changed = set()
+        while not changed:
+            if not select.select([self._fd], [], [], timeout)[0]:
+                return changed
+            changed.update(self._read())
+
+        # Collect any events that quickly follow the first, as
+        # editors and compilers often write in several steps.
+        while select.select([self._fd], [], [], self.interval)[0]:
+            changed.update(self._read())
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _read(self):
+        data = os.read(self._fd, 64*1024)
+        pos = 0
+        while pos + self.event_size <= len(data):
+            wd, mask, cookie, length = struct.unpack_from(self.event_fmt, data, pos)
+            pos += self.event_size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+            path = os.path.join(self._dirs.get(wd, ''), name)
+            if path in self.paths:
+                yield path
+
+##
+## Create the best available watcher.
+##
+def make_watcher(paths):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            logging.debug('Watcher: inotify unavailable, polling.')
+    return Watcher(paths)
@@ -5,6 +5,7 @@ from ..Action import Command
 from ..Options import Option
 from ..File import File
 from ..Scanner import CScanner
+from .gcc import Builder
 from ..utils import getarg
 from ..conv import to_list, to_iter
 
@@ -18,12 +19,14 @@ class default(use.Version):
 
 class cuda(use.Package):
     default_binary_filename = 'a.out'
+    default_builder = Builder
     versions = [default]
 
     def __init__(self, *args, **kwargs):
         super(cuda, self).__init__(*args, **kwargs)
         self.name = 'CUDA'
         self._opts.add(Option('compile', '-c'))
+        self._opts.add(Option('dependency_files', text='-MMD -MF {targets[0]}.d'))
         self._opts.add(Option('optimise', '-O', space=False))
         self._opts.add(Option('symbols', '-g'))
         self._opts.add(Option('pic', '-Xcompiler \'-fPIC\''))
@@ -59,7 +62,7 @@ class cuda(use.Package):
         for n in nodes:
             if n.scanner is None:
                 if os.path.splitext(str(n))[1].lower() in ['.c', '.cc', '.cxx', '.cpp', '.cu']:
-                    n.scanner = CScanner(self.ctx)
+                    n.scanner = opts.get('scanner', CScanner)(self.ctx)
 
         logging.debug('cuda: Done making productions.')
         return prods
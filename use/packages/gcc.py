@@ -4,7 +4,7 @@ from ..Platform import platform
 from ..Action import Command
 from ..Options import Option
 from ..File import File
-from ..Scanner import CScanner
+from ..Scanner import CScanner, read_dependency_file
 from ..utils import getarg
 from ..conv import to_list, to_iter
 
@@ -15,13 +15,28 @@ class Default(use.Version):
     def actions(self, inst, sources, targets=[], options={}):
         return [Command(self.package.options(), inst.binaries[0])]
 
+##
+## Compiles that write dependency files keep the dependencies the
+## compiler found, to be used in place of scanning on the next run.
+##
+class Builder(use.Builder):
+
+    def post_update(self, ctx):
+        if self.options.get('dependency_files', False) and self.targets:
+            paths = read_dependency_file(str(self.targets[0]) + '.d')
+            if paths is not None:
+                ctx.store_dependencies(self, paths)
+
 class gcc(use.Package):
     default_binary_filename = 'a.out'
+    default_builder = Builder
+    link_memory = 1024
     versions = [Default]
 
     def __init__(self, *args, **kwargs):
         super(gcc, self).__init__(*args, **kwargs)
         self._opts.add(Option('compile', '-c'))
+        self._opts.add(Option('dependency_files', text='-MMD -MF {targets[0]}.d'))
         self._opts.add(Option('profile', '-pg'))
         self._opts.add(Option('pic', '-fPIC'))
         self._opts.add(Option('openmp', '-fopenmp'))
@@ -63,6 +78,10 @@ class gcc(use.Package):
         # Single target or multitarget?
         single = not opts.get('compile', False)
 
+        # Links are much heavier on memory than compiles.
+        if single and 'memory' not in opts:
+            opts['memory'] = self.link_memory
+
         # Have the platform order the library directories as appropriate.
         if 'library_dirs' in opts:
             opts['library_dirs'] = platform.order_library_dirs(opts['library_dirs'])
@@ -74,7 +93,7 @@ class gcc(use.Package):
         for n in nodes:
             if n.scanner is None:
                 if os.path.splitext(str(n))[1].lower() in ['.c', '.cc', '.cxx', '.cpp']:
-                    n.scanner = CScanner(self.ctx)
+                    n.scanner = opts.get('scanner', CScanner)(self.ctx)
 
         logging.debug('gcc: Done making productions.')
         return prods
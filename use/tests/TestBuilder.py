@@ -0,0 +1,41 @@
+import unittest
+from ..Builder import Builder
+from ..Action import Command, Copy
+from ..Node import Node
+
+class Named(Node):
+
+    def __init__(self, name):
+        super(Named, self).__init__()
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+class TestBuilder(unittest.TestCase):
+
+    def builder(self, opt='0', actions=None, **options):
+        options['opt'] = opt
+        if actions is None:
+            actions = [Command('cc -O{0[opt]}', None)]
+        return Builder(None, [Named('a.c')], [Named('a.o')], actions, options)
+
+    def test_stable(self):
+        self.assertEqual(self.builder().signature(), self.builder().signature())
+        self.assertEqual(len(self.builder().signature()), 40)
+
+    def test_command_changes(self):
+        self.assertNotEqual(self.builder('0').signature(), self.builder('2').signature())
+        self.assertNotEqual(self.builder().signature(), self.builder(actions=[Command('c++ -O{0[opt]}', None)]).signature())
+        self.assertNotEqual(self.builder().signature(), self.builder(actions=[Copy(None, None)]).signature())
+
+    def test_options_change(self):
+        self.assertNotEqual(self.builder().signature(), self.builder(define=['X']).signature())
+
+    def test_nodes_by_name(self):
+        bldr = Builder(None, [Named('b.c')], [Named('a.o')], [Command('cc -O{0[opt]}', None)], {'opt': '0'})
+        self.assertNotEqual(self.builder().signature(), bldr.signature())
+
+    def test_scheduling_ignored(self):
+        self.assertEqual(self.builder().signature(), self.builder(weight=4, memory=1024).signature())
+        self.assertEqual(self.builder().signature(), self.builder(scanner=Copy).signature())
@@ -0,0 +1,85 @@
+import unittest
+from ..CompactGraph import CompactGraph
+
+class Builder(object):
+
+    def __init__(self, sources):
+        self.sources = sources
+
+class Node(object):
+
+    def __init__(self, name, sources=[], dependencies=[]):
+        self.name = name
+        self.builder = Builder(list(sources)) if sources else None
+        self.dependencies = list(dependencies)
+
+    def __repr__(self):
+        return self.name
+
+class TestCompactGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.hdr = Node('a.hh')
+        self.src = Node('a.cc', dependencies=[self.hdr])
+        self.obj = Node('a.o', [self.src])
+        self.other = Node('b.cc')
+        self.other_obj = Node('b.o', [self.other])
+        self.prog = Node('prog', [self.obj, self.other_obj])
+        self.graph = CompactGraph([self.prog])
+
+    def names(self, idxs):
+        return [repr(self.graph.nodes[i]) for i in idxs]
+
+    def test_depth_first_numbering(self):
+        self.assertEqual(self.names(range(len(self.graph))), ['prog', 'a.o', 'a.cc', 'a.hh', 'b.o', 'b.cc'])
+
+    def test_edges(self):
+        g = self.graph
+        self.assertEqual(self.names(g.inputs(g.index(self.prog))), ['a.o', 'b.o'])
+        self.assertEqual(self.names(g.inputs(g.index(self.src))), ['a.hh'])
+        self.assertEqual(self.names(g.outputs(g.index(self.hdr))), ['a.cc'])
+        self.assertEqual(self.names(g.outputs(g.index(self.prog))), [])
+        self.assertEqual(self.names(g.leaves()), ['a.hh', 'b.cc'])
+
+    def test_shared_inputs(self):
+        a = Node('a')
+        b = Node('b', [a, a])
+        c = Node('c', [a, b])
+        g = CompactGraph([c, b])
+        self.assertEqual(len(g), 3)
+        self.assertEqual(len(g.inputs(g.index(b))), 1)
+        self.assertEqual(set(self.names_of(g, g.outputs(g.index(a)))), set(['b', 'c']))
+
+    def names_of(self, g, idxs):
+        return [repr(g.nodes[i]) for i in idxs]
+
+    def test_topological_order(self):
+        order = self.names(self.graph.topological_order())
+        for before, after in [('a.hh', 'a.cc'), ('a.cc', 'a.o'), ('a.o', 'prog'), ('b.o', 'prog')]:
+            self.assertTrue(order.index(before) < order.index(after))
+        self.assertEqual(len(order), 6)
+
+    def test_downstream(self):
+        found = set(repr(n) for n in self.graph.downstream([self.hdr]))
+        self.assertEqual(found, set(['a.hh', 'a.cc', 'a.o', 'prog']))
+        outside = Node('c.cc')
+        self.assertEqual(self.graph.downstream([outside]), [outside])
+
+    def test_cycle_left_out(self):
+        a = Node('a')
+        b = Node('b')
+        a.dependencies = [b]
+        b.dependencies = [a]
+        c = Node('c', [a])
+        g = CompactGraph([c])
+        self.assertEqual(len(g), 3)
+        self.assertEqual(len(g.topological_order()), 0)
+
+    def test_deep_chain(self):
+        node = Node('n0')
+        for ii in range(1, 50000):
+            node = Node('n%d'%ii, [node])
+        g = CompactGraph([node])
+        self.assertEqual(len(g), 50000)
+        self.assertEqual(len(g.topological_order()), 50000)
+        self.assertEqual(len(g.downstream([g.nodes[-1]])), 50000)
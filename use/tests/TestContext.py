@@ -0,0 +1,137 @@
+import os, sys, shutil, tempfile, unittest
+from StringIO import StringIO
+from ..Context import Context
+from ..Builder import Builder
+from ..Scanner import CScanner
+from ..CompactGraph import CompactGraph
+
+class TestContext(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.write('a.cc', '#include "a.hh"\n')
+        self.write('a.hh', '')
+        self.write('b.hh', '')
+        self.ctx = Context()
+
+    def tearDown(self):
+        self.ctx.state.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data, mode='w'):
+        with open(path, mode) as out:
+            out.write(data)
+
+    def built(self):
+        ctx = self.ctx
+        src, hdr, obj = ctx.file('a.cc'), ctx.file('a.hh'), ctx.file('a.o')
+        obj.builder = Builder(ctx, [src], [obj])
+        src.add_products([obj])
+        src.scanner = CScanner(ctx)
+        src.scan(ctx, obj.builder)
+        ctx.graph = CompactGraph([obj])
+        for n in ctx.graph.nodes:
+            n.seen = n._invalid = n._job_done = True
+            ctx.stats[n.id] = (1, 1.0, 1)
+        return src, hdr, obj
+
+    def test_refresh(self):
+        src, hdr, obj = self.built()
+        self.assertEqual([str(n) for n in src.dependencies], ['a.hh'])
+        self.write('a.hh', '#include "b.hh"\n')
+        self.assertTrue(self.ctx.refresh([os.path.join(self.dir, 'a.hh')]))
+
+        # The includer is scanned again and everything is reset.
+        self.assertEqual([str(n) for n in src.dependencies], ['a.hh', 'b.hh'])
+        for n in [src, hdr, obj]:
+            self.assertFalse(n.seen or n._invalid or n._job_done)
+
+        # Only the changed file must be hashed again.
+        self.assertFalse(hdr.id in self.ctx.stats)
+        self.assertTrue(src.id in self.ctx.stats)
+        self.assertTrue(obj.id in self.ctx.stats)
+
+    def test_refresh_unknown(self):
+        src, hdr, obj = self.built()
+        self.assertFalse(self.ctx.refresh([os.path.join(self.dir, 'other.cc')]))
+        self.assertEqual([str(n) for n in src.dependencies], ['a.hh'])
+        self.assertFalse(src._invalid)
+
+    def test_show_configuration(self):
+        self.ctx.arguments = self.ctx.parser.parse_args(['-s', '-k', '--watch', '-j', '3', 'prog'])
+        strm = StringIO()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertRaises(SystemExit, self.ctx.show_configuration, strm)
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(strm.getvalue(), 'Current arguments:\n  -j 3\nCurrent configuration:\n')
+
+    def test_hash_sources(self):
+        for ii in range(20):
+            self.write('s%d.cc'%ii, 'int s%d;\n'%ii)
+        def nodes(ctx):
+            nds = [ctx.file('s%d.cc'%ii) for ii in range(20)] + [ctx.file('missing.cc'), ctx.file('s.o')]
+            nds[-1].builder = Builder(ctx, nds[:1], nds[-1:])
+            for nd in nds[:5]:
+                ctx.crcs[nd.id] = 'old'
+            return nds
+
+        # Threaded hashing matches hashing in order on this thread.
+        serial = nodes(self.ctx)
+        self.ctx.hash_sources(serial, 1)
+        ctx = Context()
+        try:
+            threaded = nodes(ctx)
+            ctx.hash_sources(threaded, 4)
+        finally:
+            ctx.state.close()
+        self.assertEqual([(n._crc, n._new_crc, n._stat) for n in threaded],
+                         [(n._crc, n._new_crc, n._stat) for n in serial])
+        self.assertEqual(serial[0]._crc, 'old')
+        self.assertIsNotNone(serial[19]._new_crc)
+        self.assertIsNone(serial[20]._new_crc)
+        self.assertIsNone(serial[21]._new_crc)
+
+    def use(self, argv):
+        ctx = Context()
+        args, stdout = sys.argv, sys.stdout
+        sys.argv, sys.stdout = ['use'] + argv, StringIO()
+        try:
+            ctx.parse_arguments()
+            if not ctx.needs_configure():
+                ctx.save()
+            output = sys.stdout.getvalue()
+        finally:
+            sys.argv, sys.stdout = args, stdout
+            ctx.state.close()
+        return ctx, output
+
+    def test_arguments_persist(self):
+        self.ctx.arguments = self.ctx.parser.parse_args([])
+        self.ctx.save(config=True)
+        self.ctx.crcs[1] = 'crc'
+        self.ctx.save()
+
+        # Build-time arguments are kept between runs.
+        ctx, output = self.use(['--digest', 'adler32', '-j', '3'])
+        self.assertIn('File digest has changed', output)
+        self.assertEqual(ctx.digest_type, 'adler32')
+        ctx, output = self.use([])
+        self.assertNotIn('File digest has changed', output)
+        self.assertEqual(ctx.digest_type, 'adler32')
+        self.assertEqual(ctx.argument('num_threads'), 3)
+        self.assertIsNone(ctx.crcs.get(1))
+
+        # Changing back clears digests again.
+        ctx.crcs[1] = 'crc'
+        ctx, output = self.use(['--digest', 'crc32'])
+        self.assertIn('File digest has changed', output)
+        self.assertIsNone(ctx.crcs.get(1))
+
+if __name__ == '__main__':
+    unittest.main()
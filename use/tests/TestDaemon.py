@@ -0,0 +1,154 @@
+import os, sys, json, shutil, socket, tempfile, threading, unittest
+from StringIO import StringIO
+from .. import Daemon as daemon_module
+from ..Daemon import Server, send_message, recv_message, run_client
+
+class Watcher(object):
+
+    def __init__(self, server, paths):
+        self.server = server
+        self.interval = 0
+        self.calls = [('init', paths, threading.current_thread())]
+
+    def update(self, paths):
+        self.calls.append(('update', paths, threading.current_thread()))
+
+    def wait(self, timeout=None):
+        self.calls.append(('wait', timeout, threading.current_thread()))
+        waits = len([c for c in self.calls if c[0] == 'wait'])
+        if waits == 1:
+            return set(['a.cc'])
+        elif waits == 2:
+            with self.server._lock:
+                self.server._paths = ['a.cc', 'b.cc']
+        elif waits == 3:
+            return set(['b.cc'])
+        else:
+            self.server._running = False
+        return set()
+
+    def close(self):
+        self.calls.append(('close', None, threading.current_thread()))
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.dir)
+        self.script = os.path.join(self.dir, 'usescript')
+        self.write(self.script, 'rule()\n')
+        self.write('.use.db', 'state')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data, mode='w'):
+        with open(path, mode) as out:
+            out.write(data)
+
+    def server(self):
+        server = Server(None, self.script, os.path.join(self.dir, 'sock'))
+        server._script_stat = server._stat(self.script)
+        server._db_stat = server._stat('.use.db')
+        return server
+
+    def test_message_round_trip(self):
+        left, right = socket.socketpair()
+        try:
+            data = 'x'*100000
+            thr = threading.Thread(target=send_message, args=(left, 'o', data))
+            thr.start()
+            self.assertEqual(recv_message(right), ('o', data))
+            thr.join()
+            send_message(left, 'r')
+            self.assertEqual(recv_message(right), ('r', ''))
+            left.close()
+            self.assertRaises(EOFError, recv_message, right)
+        finally:
+            right.close()
+
+    def test_parse(self):
+        server = self.server()
+        args = server._parse(['-k', 'prog', '--trace', 'out.json'])
+        self.assertEqual(args.targets, ['prog'])
+        self.assertTrue(args.keep_going)
+        self.assertEqual(args.trace, 'out.json')
+        self.assertEqual(server._parse([]).targets, [])
+        self.assertIsNone(server._parse(['configure']))
+        self.assertIsNone(server._parse(['reconfigure', 'prog']))
+        self.assertIsNone(server._parse(['-j', '4']))
+        self.assertIsNone(server._parse(['-j4', 'prog']))
+        self.assertIsNone(server._parse(['--unknown']))
+
+    def test_stale_script(self):
+        server = self.server()
+        self.assertFalse(server._stale())
+        self.write(self.script, 'rule()\nrule()\n')
+        self.assertTrue(server._stale())
+
+    def test_stale_state(self):
+        server = self.server()
+        os.remove('.use.db')
+        self.write('.use.db', 'other state')
+        self.assertTrue(server._stale())
+        server._db_stat = server._stat('.use.db')
+        self.assertFalse(server._stale())
+
+    def test_watch(self):
+        server = self.server()
+        watchers = []
+        def make_watcher(paths):
+            watchers.append(Watcher(server, paths))
+            return watchers[-1]
+        real_make_watcher = daemon_module.make_watcher
+        daemon_module.make_watcher = make_watcher
+        try:
+            server._paths = ['a.cc']
+            thr = threading.Thread(target=server._watch)
+            thr.start()
+            thr.join()
+        finally:
+            daemon_module.make_watcher = real_make_watcher
+        self.assertEqual(server._changed, set(['a.cc', 'b.cc']))
+
+        # New paths are picked up between waits, all on the one thread.
+        calls = watchers[0].calls
+        self.assertEqual([c[:2] for c in calls], [('init', ['a.cc']), ('wait', 0), ('wait', 0),
+                                                  ('update', ['a.cc', 'b.cc']), ('wait', 0),
+                                                  ('wait', 0), ('close', None)])
+        self.assertEqual(set(c[2] for c in calls), set([thr]))
+
+    def test_client_without_daemon(self):
+        self.assertIsNone(run_client(['prog'], os.path.join(self.dir, 'sock')))
+
+    def test_client(self):
+        path = os.path.join(self.dir, 'sock')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(1)
+        requests = []
+        def serve():
+            conn, addr = sock.accept()
+            requests.append(json.loads(recv_message(conn)[1]))
+            send_message(conn, 'o', 'built\n')
+            send_message(conn, 'x', '3')
+            conn.close()
+        thr = threading.Thread(target=serve)
+        thr.start()
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            code = run_client(['prog'], path)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+            thr.join()
+            sock.close()
+        self.assertEqual(code, 3)
+        self.assertEqual(output, 'built\n')
+        self.assertEqual(requests, [{'argv': ['prog']}])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import os, tempfile, binascii, hashlib, unittest
+from .. import Digest
+from ..Digest import file_digest, data_digest, digest_types
+
+class TestDigest(unittest.TestCase):
+
+    def test_crc32_matches_whole_file(self):
+        self.assertEqual(file_digest(self.path), binascii.crc32(self.data) & 0xFFFFFFFF)
+        self.assertEqual(data_digest(self.data), file_digest(self.path))
+
+    def test_hashlib_digest(self):
+        self.assertEqual(file_digest(self.path, 'sha1'), hashlib.sha1(self.data).hexdigest())
+
+    def test_all_types_agree(self):
+        for kind in digest_types:
+            self.assertEqual(file_digest(self.path, kind), data_digest(self.data, kind))
+
+    def test_missing_file(self):
+        self.assertIsNone(file_digest(self.path + '.missing'))
+
+    def setUp(self):
+        self._chunk_size = Digest.CHUNK_SIZE
+        Digest.CHUNK_SIZE = 1000
+        self.data = ''.join(chr(ii%251) for ii in range(10007))
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, self.data)
+        os.close(fd)
+
+    def tearDown(self):
+        Digest.CHUNK_SIZE = self._chunk_size
+        os.remove(self.path)
+
+if __name__ == '__main__':
+    unittest.main()
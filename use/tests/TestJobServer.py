@@ -0,0 +1,45 @@
+import os, unittest
+from ..JobServer import JobServer
+
+class TestJobServer(unittest.TestCase):
+
+    def test_create(self):
+        js = JobServer(4)
+        self.assertFalse(js.joined)
+        self.assertIn('-j4 --jobserver-auth=%d,%d'%(js._read_fd, js._write_fd), os.environ['MAKEFLAGS'])
+        tokens = js.acquire(3)
+        self.assertEqual(len(tokens), 3)
+        js.release(tokens)
+        js.close()
+        self.assertNotIn('MAKEFLAGS', os.environ)
+
+    def test_join(self):
+        rfd, wfd = os.pipe()
+        os.write(wfd, '++')
+        os.environ['MAKEFLAGS'] = 'k -j3 --jobserver-auth=%d,%d'%(rfd, wfd)
+        js = JobServer(8)
+        self.assertTrue(js.joined)
+        self.assertEqual(js.num_jobs, 3)
+        self.assertEqual(js.acquire(2), ['+', '+'])
+        js.release(['+'])
+        js.close()
+        self.assertEqual(os.read(rfd, 1), '+')
+        os.close(rfd)
+        os.close(wfd)
+
+    def test_join_invalid(self):
+        os.environ['MAKEFLAGS'] = ' -j3 --jobserver-auth=1000,1001'
+        js = JobServer(2)
+        self.assertFalse(js.joined)
+        js.close()
+
+    def setUp(self):
+        self._flags = os.environ.pop('MAKEFLAGS', None)
+
+    def tearDown(self):
+        os.environ.pop('MAKEFLAGS', None)
+        if self._flags is not None:
+            os.environ['MAKEFLAGS'] = self._flags
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import time, unittest
+from ..Node import Node
+
+class Builder(object):
+
+    def __init__(self, sources, target, output):
+        self.sources = sources
+        self.depends = []
+        self.target = target
+        self.output = output
+        self.updates = 0
+
+    def signature(self):
+        return 'signature'
+
+    @property
+    def dependent_nodes(self):
+        return self.sources + self.depends
+
+    def update(self, ctx):
+        self.updates += 1
+        self.target._new_crc = self.output
+
+class Named(Node):
+    next_id = 0
+
+    def __init__(self, name, crc=None, sources=[], output=None):
+        super(Named, self).__init__()
+        self.id = Named.next_id
+        Named.next_id += 1
+        self.name = name
+        self.crc = crc
+        if sources:
+            self.builder = Builder(sources, self, output)
+
+    def __repr__(self):
+        return self.name
+
+class Context(object):
+
+    def __init__(self, nodes):
+        self.crcs = {}
+        self.src_crcs = {}
+        self.old_bldrs = {}
+        for n in nodes:
+            self.crcs[n.id] = n.crc
+            if n.builder is not None:
+                self.src_crcs[n.id] = dict((s.id, s.crc) for s in n.builder.sources)
+                self.old_bldrs[n.id] = n.builder.signature()
+
+    def node_crc(self, node):
+        return self.crcs.get(node.id, None)
+
+    def node_source_crcs(self, node):
+        return self.src_crcs.get(node.id, None)
+
+class TestNode(unittest.TestCase):
+
+    def graph(self, obj_output):
+        src = Named('src.cc', 'a')
+        hdr = Named('src.hh', 'h')
+        src.add_dependencies([hdr])
+        obj = Named('src.o', 'o', [src], obj_output)
+        prog = Named('prog', 'p', [obj], 'p2')
+        ctx = Context([src, hdr, obj, prog])
+        ctx.src_crcs[obj.id][hdr.id] = 'h'
+        return ctx, src, hdr, obj, prog
+
+    def build(self, ctx, nodes):
+        for n in nodes:
+            n.build_job(ctx)
+
+    def test_identical_product_stops_rebuild(self):
+        ctx, src, hdr, obj, prog = self.graph('o')
+        src._invalid = True
+        src._new_crc = 'b'
+        self.build(ctx, [obj, prog])
+        self.assertEqual(obj.builder.updates, 1)
+        self.assertEqual(prog.builder.updates, 0)
+
+    def test_changed_product_rebuilds(self):
+        ctx, src, hdr, obj, prog = self.graph('o2')
+        src._invalid = True
+        src._new_crc = 'b'
+        self.build(ctx, [obj, prog])
+        self.assertEqual(obj.builder.updates, 1)
+        self.assertEqual(prog.builder.updates, 1)
+
+    def test_scanned_dependency_rebuilds(self):
+        ctx, src, hdr, obj, prog = self.graph('o')
+        hdr._invalid = True
+        hdr._new_crc = 'h2'
+        self.build(ctx, [obj, prog])
+        self.assertEqual(obj.builder.updates, 1)
+        self.assertEqual(prog.builder.updates, 0)
+
+    def test_unchanged(self):
+        ctx, src, hdr, obj, prog = self.graph('o')
+        self.build(ctx, [obj, prog])
+        self.assertEqual(obj.builder.updates, 0)
+        self.assertEqual(prog.builder.updates, 0)
+
+    def test_missing_input_rebuilds(self):
+        ctx, src, hdr, obj, prog = self.graph('o')
+        src._invalid = True
+        self.build(ctx, [obj])
+        self.assertEqual(obj.builder.updates, 1)
+
+    def test_slot_held_while_updating(self):
+        ctx, src, hdr, obj, prog = self.graph('o2')
+        entered = []
+        class Slot(object):
+            def __enter__(self):
+                entered.append(obj.builder.updates)
+            def __exit__(self, *exc):
+                entered.append(obj.builder.updates)
+        src.build_job(ctx, Slot())
+        obj.build_job(ctx, Slot())
+        self.assertEqual(entered, [])
+        src._invalid = True
+        src._new_crc = 'b'
+        obj._invalid = False
+        obj.build_job(ctx, Slot())
+        self.assertEqual(entered, [0, 1])
+
+    def test_scan_union(self):
+        class ScanBuilder(object):
+            def __init__(self, dirs):
+                self.options = {'header_dirs': dirs}
+        class Scanner(object):
+            scans = 0
+            def key(self, bldr):
+                return tuple(bldr.options['header_dirs'])
+            def find_all(self, node, bldr):
+                Scanner.scans += 1
+                return [hdrs[d] for d in ['common'] + bldr.options['header_dirs']]
+        class ScanContext(object):
+            def stored_dependencies(self, bldr):
+                return None
+        hdrs = dict((d, Named(d + '.hh')) for d in ['common', 'a', 'b'])
+        src = Named('src.cc')
+        src.scanner = Scanner()
+        ctx = ScanContext()
+        src.scan(ctx, ScanBuilder(['a']))
+        src.scan(ctx, ScanBuilder(['a']))
+        src.scan(ctx, ScanBuilder(['b']))
+        self.assertEqual(Scanner.scans, 2)
+        self.assertEqual([str(n) for n in src.dependencies], ['common.hh', 'a.hh', 'b.hh'])
+        self.assertEqual(hdrs['common'].progenitors, [src])
+
+    def test_edges(self):
+        a, b, c = Named('a'), Named('b'), Named('c')
+        self.assertEqual(a.dependencies, ())
+        a.add_dependencies([b, c])
+        self.assertEqual(a.dependencies, [b, c])
+        self.assertEqual(b.progenitors, [a])
+        self.assertEqual(c.progenitors, [a])
+        b.add_products([c])
+        self.assertEqual(b.products, [c])
+
+    def test_shared_headers_scale(self):
+        def build(num_srcs):
+            hdrs = [Named('h%d.hh'%ii) for ii in range(20)]
+            srcs = [Named('s%d.cc'%ii) for ii in range(num_srcs)]
+            start = time.time()
+            for src in srcs:
+                src.add_dependencies(hdrs)
+            elapsed = time.time() - start
+            self.assertEqual(len(hdrs[0].progenitors), num_srcs)
+            return elapsed, hdrs
+
+        # Edge lists grow in place rather than being copied.
+        elapsed, hdrs = build(2)
+        progenitors = hdrs[0].progenitors
+        Named('s.cc').add_dependencies(hdrs)
+        self.assertIs(hdrs[0].progenitors, progenitors)
+
+        # Four times the sources takes about four times as long, where
+        # copying would take sixteen.
+        small = min(build(2000)[0] for ii in range(3))
+        large = min(build(8000)[0] for ii in range(3))
+        self.assertLess(large, 10*max(small, 0.001))
@@ -0,0 +1,66 @@
+import os, shutil, tempfile, unittest
+from ..Preprocessor import read_directives, included_names, macro_definitions
+
+class TestPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def names(self, data, defines=()):
+        path = os.path.join(self.dir, 'a.hh')
+        with open(path, 'w') as out:
+            out.write(data)
+        return included_names(read_directives(path), macro_definitions(list(defines)))
+
+    def test_comments(self):
+        data = '/* #include "a.hh"\n */\n// #include "b.hh"\n#include "c.hh" // note\nchar *s = "/*";\n#include <d.hh>\n'
+        self.assertEqual(self.names(data), ['c.hh', 'd.hh'])
+
+    def test_ifdef(self):
+        data = '#ifdef HAVE_GLUT\n#include <GL/glut.h>\n#else\n#include "noglut.hh"\n#endif\n'
+        self.assertEqual(self.names(data), ['GL/glut.h', 'noglut.hh'])
+        self.assertEqual(self.names(data, ['HAVE_GLUT']), ['GL/glut.h'])
+        self.assertEqual(self.names('#undef HAVE_GLUT\n' + data), ['noglut.hh'])
+
+    def test_if_expressions(self):
+        data = ('#if defined(NDEBUG) && !defined NLOG\n#include "a.hh"\n'
+                '#elif LEVEL > 2 || (LEVEL == 1)\n#include "b.hh"\n'
+                '#else\n#include "c.hh"\n#endif\n')
+        self.assertEqual(self.names('#undef NLOG\n' + data, ['NDEBUG']), ['a.hh'])
+        self.assertEqual(self.names(data, ['NDEBUG', 'NLOG', 'LEVEL=3']), ['b.hh'])
+        self.assertEqual(self.names(data, ['NLOG', ('LEVEL', 1)]), ['b.hh'])
+        self.assertEqual(self.names(data, ['NLOG', 'LEVEL=2']), ['c.hh'])
+
+    def test_nested_and_local_defines(self):
+        data = ('#ifndef A_HH\n#define A_HH\n#define USE_B 1\n'
+                '#if 0\n#include "never.hh"\n#if 1\n#include "never2.hh"\n#endif\n#else\n'
+                '#if USE_B\n#include "b.hh"\n#endif\n#endif\n'
+                '#undef USE_B\n#if USE_B\n#include "c.hh"\n#endif\n#endif\n')
+        self.assertEqual(self.names(data), ['b.hh'])
+
+    def test_unknown_conditions_kept(self):
+        data = ('#if __has_include(<x.h>)\n#include <x.h>\n#else\n#include "y.hh"\n#endif\n'
+                '#if defined(A) ? 1 : 0\n#include "z.hh"\n#endif\n')
+        self.assertEqual(self.names(data), ['x.h', 'y.hh', 'z.hh'])
+
+    def test_unknown_macros(self):
+        data = ('#if defined(__linux__)\n#include "linux.h"\n#else\n#include "other.h"\n#endif\n'
+                '#if LEVEL > 1\n#include "level.h"\n#endif\n')
+        self.assertEqual(self.names(data), ['linux.h', 'other.h', 'level.h'])
+        self.assertEqual(self.names(data, [('__linux__', 1), 'LEVEL=0']), ['linux.h'])
+        self.assertEqual(self.names('#undef __linux__\n#undef LEVEL\n' + data), ['other.h'])
+
+        # Defines under an unknown condition leave the macro unknown.
+        data = '#ifdef A\n#define B\n#endif\n#ifdef B\n#include "b.h"\n#endif\n'
+        self.assertEqual(self.names('#undef B\n' + data), ['b.h'])
+        self.assertEqual(self.names('#undef A\n#undef B\n' + data), [])
+
+    def test_all_includes(self):
+        path = os.path.join(self.dir, 'a.hh')
+        with open(path, 'w') as out:
+            out.write('#if 0\n#include "a.hh"\n#endif\n  #  include <b.hh>\n#include MACRO\n')
+        self.assertEqual(included_names(read_directives(path)), ['a.hh', 'b.hh'])
+        self.assertEqual(read_directives(os.path.join(self.dir, 'missing.hh')), [])
@@ -0,0 +1,91 @@
+import os, shutil, tempfile, unittest
+from .. import Rule as rule_module
+from ..Rule import match_sources, walk_files, literal_dir
+
+class TestRule(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        for path in ['src/a.cc', 'src/a.hh', 'src/sub/b.cc', 'src/sub/b.hh', 'README',
+                     'build/src/a.cc', 'build/gen/c.cc', '.git/x.cc']:
+            if not os.path.exists(os.path.dirname(path) or '.'):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        os.symlink('missing', 'src/broken.cc')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_walk_order(self):
+        walked = list(walk_files())
+        expected = []
+        for dir_path, dir_names, file_names in os.walk('.', followlinks=True):
+            expected.extend(os.path.join(dir_path, f)[2:] for f in file_names)
+        expected.remove('src/broken.cc')
+        self.assertEqual(walked, expected)
+
+    def test_match_sources(self):
+        found = match_sources([r'src/.+\.cc$', r'src/.+\.hh$', r'(src)/\1?a\.hh$', 'none'])
+        self.assertEqual(sorted(found[r'src/.+\.cc$']), ['src/a.cc', 'src/sub/b.cc'])
+        self.assertEqual(sorted(found[r'src/.+\.hh$']), ['src/a.hh', 'src/sub/b.hh'])
+        self.assertEqual(found[r'(src)/\1?a\.hh$'], ['src/a.hh'])
+        self.assertEqual(found['none'], [])
+
+    def test_without_scandir(self):
+        scandir = rule_module.scandir
+        rule_module.scandir = None
+        try:
+            self.assertEqual(sorted(walk_files()), ['.git/x.cc', 'README', 'build/gen/c.cc', 'build/src/a.cc',
+                                                    'src/a.cc', 'src/a.hh', 'src/sub/b.cc', 'src/sub/b.hh'])
+        finally:
+            rule_module.scandir = scandir
+
+    def test_literal_dir(self):
+        self.assertEqual(literal_dir(r'src/.+\.cc$'), 'src')
+        self.assertEqual(literal_dir(r'^src/sub/b\.cc$'), 'src/sub')
+        self.assertEqual(literal_dir(r'src/su?b/.*'), 'src')
+        self.assertEqual(literal_dir(r'src/sub+/.*'), 'src')
+        self.assertEqual(literal_dir(r'src\/x/.*'), 'src/x')
+        self.assertEqual(literal_dir(r'src\d/.*'), '')
+        self.assertEqual(literal_dir(r'a.cc'), '')
+        self.assertEqual(literal_dir(r'src/a|b/.*'), '')
+
+    def test_pruning(self):
+        found = match_sources([r'src/sub/.+\.cc$', r'.+\.cc$', r'build/gen/.+\.cc$'], ['.git'], ['build'])
+        self.assertEqual(sorted(found[r'.+\.cc$']), ['src/a.cc', 'src/sub/b.cc'])
+        self.assertEqual(found[r'build/gen/.+\.cc$'], ['build/gen/c.cc'])
+        self.assertEqual(found[r'src/sub/.+\.cc$'], ['src/sub/b.cc'])
+        found = match_sources([r'src/.+\.cc$'])
+        self.assertEqual(sorted(found[r'src/.+\.cc$']), ['src/a.cc', 'src/sub/b.cc'])
+
+    def test_ignored_paths_are_anchored(self):
+        os.makedirs('src/build')
+        open('src/build/b.cc', 'w').close()
+        os.makedirs('src/.git')
+        open('src/.git/c.cc', 'w').close()
+        found = match_sources([r'src/.+\.cc$'], ['.git'], ['build'])
+        self.assertEqual(sorted(found[r'src/.+\.cc$']), ['src/a.cc', 'src/build/b.cc', 'src/sub/b.cc'])
+
+    def test_only_prefix_walked(self):
+        listed = []
+        list_dir = rule_module._list_dir
+        def counting_list_dir(path):
+            listed.append(path)
+            return list_dir(path)
+        rule_module._list_dir = counting_list_dir
+        try:
+            match_sources([r'src/sub/.+\.cc$'])
+        finally:
+            rule_module._list_dir = list_dir
+        self.assertEqual(listed, ['.', 'src', 'src/sub'])
+
+    def test_link_loop(self):
+        os.symlink('..', 'src/sub/up')
+        os.symlink('sub', 'src/again')
+        walked = list(walk_files())
+        self.assertEqual(walked.count('src/sub/b.cc'), 1)
+        self.assertEqual(walked.count('src/again/b.cc'), 1)
+        self.assertFalse(any(p.startswith('src/sub/up/') for p in walked))
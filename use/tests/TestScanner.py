@@ -0,0 +1,242 @@
+import os, shutil, tempfile, unittest, multiprocessing
+from .. import Preprocessor as preprocessor_module
+from ..Scanner import CScanner, CPreprocessorScanner, IncludeGraph, read_dependency_file
+from ..Validatable import Validatable
+from ..Action import Command
+
+class Builder(object):
+
+    def __init__(self, sources=[], options={}, actions=[]):
+        self.sources = list(sources)
+        self.options = dict(options)
+        self.actions = list(actions)
+
+class Node(Validatable):
+
+    def __init__(self, path, id, builder=None):
+        self.path = path
+        self.id = id
+        self.builder = builder
+
+    def __repr__(self):
+        return self.path
+
+class State(object):
+
+    def __init__(self):
+        self.includes = {}
+
+class Context(object):
+
+    def __init__(self):
+        self._node_map = {}
+        self.state = State()
+        self.includes = IncludeGraph(self)
+
+    def find_node(self, path):
+        return self._node_map.get(os.path.normpath(path), None)
+
+    def file(self, path):
+        path = os.path.normpath(path)
+        if path not in self._node_map:
+            self._node_map[path] = Node(path, len(self._node_map))
+        return self._node_map[path]
+
+    def norm_path(self, path):
+        return os.path.normpath(path)
+
+class TestScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.ctx = Context()
+        self.opened = []
+        real_open = open
+        def counting_open(path, *args):
+            self.opened.append(os.path.normpath(path))
+            return real_open(path, *args)
+        preprocessor_module.open = counting_open
+
+    def tearDown(self):
+        del preprocessor_module.open
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as out:
+            out.write(data)
+        return path
+
+    def scan(self, path, bldr=None):
+        node = self.ctx.file(path)
+        return [os.path.basename(str(n)) for n in CScanner(self.ctx).find_all(node, bldr or Builder())]
+
+    def test_transitive(self):
+        self.write('a.hh', '#include "b.hh"\n#include "c.hh"\n')
+        self.write('b.hh', '#include "c.hh"\n')
+        self.write('c.hh', '#include <missing.hh>\n')
+        src = self.write('a.cc', '#include "a.hh"\n')
+        self.assertEqual(self.scan(src), ['a.hh', 'b.hh', 'c.hh'])
+
+    def test_headers_read_once(self):
+        self.write('a.hh', '#include "b.hh"\n')
+        self.write('b.hh', '')
+        srcs = [self.write('%d.cc'%ii, '#include "a.hh"\n#include "b.hh"\n') for ii in range(5)]
+        for src in srcs:
+            self.assertEqual(self.scan(src), ['a.hh', 'b.hh'])
+        hdrs = [p for p in self.opened if p.endswith('.hh')]
+        self.assertEqual(sorted(hdrs), sorted(os.path.join(self.dir, h) for h in ['a.hh', 'b.hh']))
+
+    def test_cycle(self):
+        self.write('a.hh', '#include "b.hh"\n#include "d.hh"\n')
+        self.write('b.hh', '#include "a.hh"\n#include "c.hh"\n')
+        self.write('c.hh', '')
+        self.write('d.hh', '')
+        one = self.write('one.cc', '#include "a.hh"\n')
+        two = self.write('two.cc', '#include "b.hh"\n')
+        self.assertEqual(set(self.scan(one)), set(['a.hh', 'b.hh', 'c.hh', 'd.hh']))
+        self.assertEqual(set(self.scan(two)), set(['a.hh', 'b.hh', 'c.hh', 'd.hh']))
+
+    def test_header_dirs(self):
+        os.mkdir(os.path.join(self.dir, 'inc'))
+        hdr = self.write('inc/x.hh', '')
+        self.ctx.file(hdr)
+        src = self.write('a.cc', '#include <x.hh>\n')
+        self.assertEqual(self.scan(src), [])
+        bldr = Builder(options={'header_dirs': [os.path.join(self.dir, 'inc')]})
+        self.assertEqual(self.scan(src, bldr), ['x.hh'])
+
+    def test_built_header(self):
+        orig = self.write('orig.hh', '#include "dep.hh"\n')
+        os.mkdir(os.path.join(self.dir, 'inc'))
+        self.write('inc/dep.hh', '')
+        built = self.ctx.file(os.path.join(self.dir, 'inc', 'copy.hh'))
+        built.builder = Builder([self.ctx.file(orig)])
+        src = self.write('a.cc', '#include "inc/copy.hh"\n')
+        self.assertEqual(self.scan(src), ['copy.hh', 'dep.hh'])
+
+    def test_forget(self):
+        hdr = self.write('a.hh', '')
+        src = self.write('a.cc', '#include "a.hh"\n')
+        self.write('b.hh', '')
+        self.assertEqual(self.scan(src), ['a.hh'])
+        self.write('a.hh', '#include "b.hh"\n')
+        self.assertEqual(self.scan(src), ['a.hh'])
+        self.ctx.includes.forget([hdr])
+        self.assertEqual(self.scan(src), ['a.hh', 'b.hh'])
+
+    def test_names_kept_between_runs(self):
+        self.write('a.hh', '#include "b.hh"\n')
+        self.write('b.hh', '')
+        src = self.write('a.cc', '#include "a.hh"\n')
+        self.assertEqual(self.scan(src), ['a.hh', 'b.hh'])
+        self.assertEqual(len(self.opened), 3)
+
+        # A new run reads nothing while the files are unchanged.
+        self.ctx.includes = IncludeGraph(self.ctx)
+        del self.opened[:]
+        self.assertEqual(self.scan(src), ['a.hh', 'b.hh'])
+        self.assertEqual(self.opened, [])
+
+        self.ctx.includes = IncludeGraph(self.ctx)
+        hdr = self.write('a.hh', '#include "b.hh"\n#include "c.hh"\n')
+        os.utime(hdr, (0, 0))
+        self.write('c.hh', '')
+        self.assertEqual(self.scan(src), ['a.hh', 'b.hh', 'c.hh'])
+        self.assertEqual(sorted(self.opened), [hdr, os.path.join(self.dir, 'c.hh')])
+
+    def test_prefetch(self):
+        hdrs = ['h%d.hh'%ii for ii in range(100)]
+        for ii, hdr in enumerate(hdrs):
+            self.write(hdr, '#include "common.hh"\n#include "g%d.hh"\n'%ii)
+            self.write('g%d.hh'%ii, '#define G%d\n'%ii)
+        self.write('common.hh', '')
+        src = self.write('a.cc', ''.join('#include "%s"\n'%h for h in hdrs))
+
+        # Both levels of headers are read in the same pool.
+        pools = []
+        Pool = multiprocessing.Pool
+        def counting_pool(*args):
+            pools.append(args)
+            return Pool(*args)
+        multiprocessing.Pool = counting_pool
+        try:
+            self.ctx.includes.prefetch([(self.ctx.file(src), ())], 2)
+        finally:
+            multiprocessing.Pool = Pool
+        self.assertEqual(pools, [(2,)])
+        del self.opened[:]
+        self.assertEqual(self.scan(src), [hdrs[0], 'common.hh', 'g0.hh'] +
+                         sum([[h, 'g%d.hh'%ii] for ii, h in enumerate(hdrs)][1:], []))
+        self.assertEqual(self.opened, [])
+        self.assertEqual(len(self.ctx.state.includes), 202)
+
+        # The same is read as without a pool.
+        serial = Context()
+        serial.includes.prefetch([(serial.file(src), ())], 1)
+        self.assertEqual(serial.includes._directives, self.ctx.includes._directives)
+
+    def test_read_dependency_file(self):
+        path = self.write('a.o.d', 'build/a.o: src/a.cc src/a.hh \\\n  /usr/include/my\\ dir/b.hh \\\n  inc/../c.hh\n')
+        self.assertEqual(read_dependency_file(path), ['src/a.cc', 'src/a.hh', '/usr/include/my dir/b.hh', 'c.hh'])
+        self.assertEqual(read_dependency_file(os.path.join(self.dir, 'missing.d')), None)
+
+    def test_preprocessor_scanner(self):
+        self.write('glut.hh', '#include "gl.hh"\n')
+        self.write('gl.hh', '')
+        self.write('none.hh', '')
+        src = self.write('a.cc', '#ifdef HAVE_GLUT\n#include "glut.hh"\n#else\n#include "none.hh"\n#endif\n')
+        node = self.ctx.file(src)
+        found = lambda bldr: [os.path.basename(str(n)) for n in CPreprocessorScanner(self.ctx).find_all(node, bldr)]
+        self.assertEqual(found(Builder()), ['glut.hh', 'gl.hh', 'none.hh'])
+        self.assertEqual(found(Builder(options={'define': ['HAVE_GLUT']})), ['glut.hh', 'gl.hh'])
+        self.assertEqual(self.scan(src), ['glut.hh', 'gl.hh', 'none.hh'])
+
+    def test_predefined_macros(self):
+        self.write('glut.hh', '')
+        self.write('none.hh', '')
+        src = self.write('a.cc', '#if HAVE_GLUT\n#include "glut.hh"\n#else\n#include "none.hh"\n#endif\n')
+        node = self.ctx.file(src)
+        found = lambda bldr: [os.path.basename(str(n)) for n in CPreprocessorScanner(self.ctx).find_all(node, bldr)]
+        missing = Builder(actions=[Command('', 'no-such-compiler')])
+        self.assertEqual(found(missing), ['glut.hh', 'none.hh'])
+        self.assertEqual(self.ctx.includes.predefined('no-such-compiler', 'c++'), {})
+
+        # The "define" option overrides the compiler's macros.
+        self.ctx.includes._predefined[('cc', 'c++')] = {'HAVE_GLUT': '1'}
+        bldr = Builder(actions=[Command('', 'cc')])
+        self.assertEqual(found(bldr), ['glut.hh'])
+        self.assertEqual(found(Builder(options={'define': ['HAVE_GLUT=0']}, actions=[Command('', 'cc')])), ['none.hh'])
+
+    def test_missing_headers_searched_once(self):
+        dirs = [os.path.join(self.dir, 'inc%d'%ii) for ii in range(3)]
+        for d in dirs:
+            os.mkdir(d)
+        self.write('inc1/on_disk.hh', '')
+        self.ctx.file(os.path.join(dirs[2], 'built.hh'))
+        bldr = Builder(options={'header_dirs': dirs})
+        srcs = [self.write('%d.cc'%ii, '#include <vector>\n#include <on_disk.hh>\n#include <built.hh>\n')
+                for ii in range(5)]
+        for src in srcs:
+            self.ctx.file(src)
+        listed = []
+        listdir = os.listdir
+        def counting_listdir(path):
+            listed.append(path)
+            return listdir(path)
+        os.listdir = counting_listdir
+        try:
+            for src in srcs:
+                self.assertEqual(self.scan(src, bldr), ['on_disk.hh', 'built.hh'])
+
+            # Each header directory is listed once.
+            self.assertEqual(sorted(p for p in listed if p in dirs), dirs)
+
+            # Misses are kept, even when a node is added, until forgotten.
+            path = self.write('inc1/vector', '')
+            self.ctx.file(path)
+            self.assertEqual(self.scan(srcs[0], bldr), ['on_disk.hh', 'built.hh'])
+            self.ctx.includes.forget([path])
+            self.assertEqual(self.scan(srcs[0], bldr), ['vector', 'on_disk.hh', 'built.hh'])
+        finally:
+            os.listdir = listdir
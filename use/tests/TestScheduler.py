@@ -0,0 +1,205 @@
+import time, threading, unittest
+from ..Scheduler import Scheduler
+from ..Action import CommandFailed
+from ..JobServer import JobServer
+
+class Builder(object):
+
+    def __init__(self, sources, weight=1, memory=0):
+        self.sources = sources
+        self.weight = weight
+        self.memory = memory
+
+class Node(object):
+
+    def __init__(self, name, sources=[], dependencies=[], fail=False):
+        self.name = name
+        self.builder = Builder(list(sources)) if sources else None
+        self.dependencies = list(dependencies)
+        self.seen = False
+        self.fail = fail
+        self.weight = self.builder.weight if self.builder else 1
+        self.memory = self.builder.memory if self.builder else 0
+        self._blocked = False
+
+    def __repr__(self):
+        return self.name
+
+    def build_job(self, ctx, slot=None):
+        if slot is not None and self.builder:
+            with slot:
+                return self._build(ctx)
+        return self._build(ctx)
+
+    def _build(self, ctx):
+        with ctx.lock:
+            ctx.order.append(self)
+            ctx.cpus += self.weight
+            ctx.memory += self.memory
+            ctx.max_cpus = max(ctx.max_cpus, ctx.cpus)
+            ctx.max_memory = max(ctx.max_memory, ctx.memory)
+        time.sleep(ctx.delay)
+        with ctx.lock:
+            ctx.cpus -= self.weight
+            ctx.memory -= self.memory
+        if self.fail:
+            raise CommandFailed(None)
+        return True
+
+class Context(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.order = []
+        self.durations = {}
+        self.journaled = []
+        self.cpus = 0
+        self.memory = 0
+        self.max_cpus = 0
+        self.max_memory = 0
+        self.delay = 0
+
+    def node_duration(self, node):
+        return self.durations.get(repr(node), None)
+
+    def journal_node(self, node):
+        self.journaled.append(node)
+
+class TestScheduler(unittest.TestCase):
+
+    def test_inputs_before_products(self):
+        for num_threads in [1, 4]:
+            ctx, tgt = self._graph()
+            sched = Scheduler(ctx, num_threads)
+            sched.add_targets([tgt])
+            self.assertTrue(sched.run())
+            self.assertEqual(len(ctx.order), 6)
+            for node in ctx.order:
+                self.assertTrue(node.seen)
+                srcs = node.builder.sources if node.builder else []
+                for inp in srcs + node.dependencies:
+                    self.assertLess(ctx.order.index(inp), ctx.order.index(node))
+
+    def test_shared_inputs_built_once(self):
+        ctx, tgt = self._graph()
+        sched = Scheduler(ctx, 1)
+        sched.add_targets([tgt, tgt.builder.sources[0]])
+        sched.run()
+        self.assertEqual(len(ctx.order), len(set(ctx.order)))
+
+    def test_failure_stops(self):
+        ctx = Context()
+        a = Node('a', fail=True)
+        b = Node('b', [a])
+        sched = Scheduler(ctx, 1)
+        sched.add_targets([b])
+        self.assertFalse(sched.run())
+        self.assertEqual(ctx.order, [a])
+
+    def test_keep_going(self):
+        ctx = Context()
+        a = Node('a', fail=True)
+        b = Node('b', [a])
+        c = Node('c')
+        d = Node('d', [b, c])
+        e = Node('e', [c])
+        sched = Scheduler(ctx, 2, keep_going=True)
+        sched.add_targets([d, e])
+        self.assertFalse(sched.run())
+        self.assertEqual(set(ctx.order), set([a, c, e]))
+        self.assertEqual([f[0] for f in sched.failures], [a])
+        self.assertTrue(a._blocked and b._blocked and d._blocked)
+        self.assertFalse(c._blocked or e._blocked)
+        self.assertEqual(set(ctx.journaled), set([c, e]))
+
+    def test_weighted_jobs(self):
+        ctx = Context()
+        ctx.delay = 0.02
+        srcs = [Node('src%d'%ii) for ii in range(8)]
+        objs = [Node('obj%d'%ii, [s]) for ii, s in enumerate(srcs)]
+        links = [Node('link%d'%ii, [o]) for ii, o in enumerate(objs[:3])]
+        for l in links:
+            l.weight = l.builder.weight = 3
+        sched = Scheduler(ctx, 4)
+        sched.add_targets(links + objs)
+        self.assertTrue(sched.run())
+        self.assertEqual(len(ctx.order), 19)
+        self.assertEqual(ctx.max_cpus, 4)
+
+    def test_memory_budget(self):
+        ctx = Context()
+        ctx.delay = 0.02
+        srcs = [Node('src%d'%ii) for ii in range(4)]
+        links = [Node('link%d'%ii, [s]) for ii, s in enumerate(srcs)]
+        for l in links:
+            l.memory = l.builder.memory = 600
+        sched = Scheduler(ctx, 4, memory=1000)
+        sched.add_targets(links)
+        self.assertTrue(sched.run())
+        self.assertEqual(len(ctx.order), 8)
+        self.assertLessEqual(ctx.max_memory, 1000)
+
+    def test_jobserver_tokens(self):
+        ctx = Context()
+        ctx.delay = 0.01
+        js = JobServer(3)
+        srcs = [Node('src%d'%ii) for ii in range(6)]
+        sched = Scheduler(ctx, 3, jobserver=js)
+        sched.add_targets(srcs)
+        self.assertTrue(sched.run())
+        self.assertEqual(len(js.acquire(2)), 2)
+        js.close()
+
+    def test_jobserver_tokens_only_for_builders(self):
+        ctx = Context()
+        js = JobServer(2)
+        acquired = []
+        acquire = js.acquire
+        def counting_acquire(n):
+            acquired.append(n)
+            return acquire(n)
+        js.acquire = counting_acquire
+        srcs = [Node('src%d'%ii) for ii in range(6)]
+        objs = [Node('obj%d'%ii, [s]) for ii, s in enumerate(srcs[:2])]
+        sched = Scheduler(ctx, 2, jobserver=js)
+        sched.add_targets(srcs + objs)
+        self.assertTrue(sched.run())
+        self.assertEqual(len(acquired), 2)
+        self.assertEqual(len(js.acquire(1)), 1)
+        js.close()
+
+    def test_cycle(self):
+        ctx = Context()
+        a = Node('a')
+        b = Node('b', [a])
+        a.dependencies.append(b)
+        sched = Scheduler(ctx, 1)
+        sched.add_targets([b])
+        self.assertFalse(sched.run())
+        self.assertEqual(ctx.order, [])
+
+    def test_critical_path_first(self):
+        ctx = Context()
+        short = Node('short')
+        long = Node('long')
+        short_obj = Node('short_obj', [short])
+        long_obj = Node('long_obj', [long])
+        link = Node('link', [long_obj])
+        ctx.durations = {'short_obj': 1.0, 'long_obj': 1.0, 'link': 10.0}
+        sched = Scheduler(ctx, 1)
+        sched.add_targets([short_obj, link])
+        sched.run()
+        self.assertEqual(ctx.order, [long, long_obj, link, short, short_obj])
+
+    def _graph(self):
+        ctx = Context()
+        hdr = Node('hdr')
+        src0 = Node('src0', dependencies=[hdr])
+        src1 = Node('src1', dependencies=[hdr])
+        obj0 = Node('obj0', [src0])
+        obj1 = Node('obj1', [src1])
+        prog = Node('prog', [obj0, obj1])
+        return ctx, prog
+
+if __name__ == '__main__':
+    unittest.main()
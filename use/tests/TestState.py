@@ -0,0 +1,199 @@
+import os, pickle, shutil, tempfile, threading, time, unittest
+from ..State import State
+
+class Config(object):
+
+    def __init__(self, value):
+        self.value = value
+
+class TestState(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, '.use.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_missing(self):
+        state = State(self.path)
+        self.assertFalse(state.exists())
+        self.assertEqual(state.load_config(), None)
+        self.assertEqual(state.crcs.get(0), None)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_round_trip(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.crcs[1] = 'ff'
+        state.stats[0] = (10, 1.5, 3)
+        state.source_crcs[1] = {0: 1}
+        state.save(Config(42))
+        state.close()
+
+        state = State(self.path)
+        self.assertTrue(state.exists())
+        self.assertEqual(state.load_config().value, 42)
+        self.assertEqual(state.crcs.get(0), 1)
+        self.assertEqual(state.crcs.get(1), 'ff')
+        self.assertEqual(state.stats.get(0), (10, 1.5, 3))
+        self.assertEqual(state.source_crcs.get(1), {0: 1})
+
+    def test_row_updates(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.crcs[1] = 2
+        state.durations[0] = 0.5
+        state.save(Config(1))
+        state.close()
+
+        state = State(self.path)
+        state.crcs[0] = 3
+        state.crcs.pop(1)
+        state.save()
+        state.close()
+
+        state = State(self.path)
+        self.assertEqual(state.load_config().value, 1)
+        self.assertEqual(state.crcs.get(0), 3)
+        self.assertFalse(1 in state.crcs)
+        self.assertEqual(state.durations.get(0), 0.5)
+
+    def test_unchanged_not_written(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.save(Config(1))
+        state.close()
+        with open(self.path, 'rb') as inf:
+            data = inf.read()
+
+        state = State(self.path)
+        state.load_config()
+        state.crcs[0] = 1
+        state.save()
+        state.close()
+        with open(self.path, 'rb') as inf:
+            self.assertEqual(inf.read(), data)
+
+    def test_clear(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.durations[0] = 0.5
+        state.save(Config(1))
+        state.clear(['crcs'])
+        state.save()
+        state.close()
+
+        state = State(self.path)
+        self.assertEqual(len(state.crcs), 0)
+        self.assertEqual(state.durations.get(0), 0.5)
+
+    def test_old_format_replaced(self):
+        with open(self.path, 'w') as out:
+            pickle.dump({'crcs': {}}, out)
+        state = State(self.path)
+        self.assertFalse(state.exists())
+        self.assertEqual(state.load_config(), None)
+        state.crcs[0] = 1
+        state.save(Config(1))
+        self.assertTrue(state.exists())
+        self.assertEqual(state.crcs.get(0), 1)
+
+    def test_journal_replay(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.crcs[1] = 2
+        state.save(Config(1))
+
+        # Journal some jobs, then lose the process without saving.
+        state.crcs[0] = 3
+        state.source_crcs[0] = {5: 4}
+        state.record(0)
+        state.crcs.pop(1)
+        state.record(1)
+        state.record(2)
+        state._close_journal()
+        self.assertTrue(os.path.exists(state.journal_path))
+
+        state = State(self.path)
+        self.assertEqual(state.crcs.get(0), 3)
+        self.assertEqual(state.source_crcs.get(0), {5: 4})
+        self.assertFalse(1 in state.crcs)
+        self.assertFalse(os.path.exists(state.journal_path))
+
+    def test_journal_torn_entry(self):
+        state = State(self.path)
+        state.save(Config(1))
+        state.crcs[0] = 1
+        state.record(0)
+        state.crcs[1] = 2
+        state.record(1)
+        state._close_journal()
+        with open(state.journal_path, 'rb+') as out:
+            out.truncate(os.path.getsize(state.journal_path) - 3)
+
+        state = State(self.path)
+        self.assertEqual(state.crcs.get(0), 1)
+        self.assertFalse(1 in state.crcs)
+
+    def test_journal_group_sync(self):
+        state = State(self.path)
+        state.save(Config(1))
+        syncs = []
+        sync_name = 'fdatasync' if hasattr(os, 'fdatasync') else 'fsync'
+        real_sync = getattr(os, sync_name)
+        def slow_sync(fd):
+            syncs.append(fd)
+            time.sleep(0.05)
+            real_sync(fd)
+        def record(key):
+            state.crcs[key] = key
+            state.record(key)
+        setattr(os, sync_name, slow_sync)
+        try:
+            threads = [threading.Thread(target=record, args=(ii,)) for ii in range(8)]
+            for thr in threads:
+                thr.start()
+            for thr in threads:
+                thr.join()
+        finally:
+            setattr(os, sync_name, real_sync)
+        self.assertLess(len(syncs), 8)
+        state._close_journal()
+
+        state = State(self.path)
+        for ii in range(8):
+            self.assertEqual(state.crcs.get(ii), ii)
+
+    def test_save_discards_journal(self):
+        state = State(self.path)
+        state.crcs[0] = 1
+        state.record(0)
+        state.save(Config(1))
+        self.assertFalse(os.path.exists(state.journal_path))
+
+    def test_node_ids(self):
+        state = State(self.path)
+        self.assertEqual(state.node_id('a.cc'), 0)
+        self.assertEqual(state.node_id('b.cc'), 1)
+        self.assertEqual(state.node_id('a.cc'), 0)
+        state.save(Config(1))
+        state.close()
+
+        state = State(self.path)
+        self.assertEqual(state.node_id('b.cc'), 1)
+        self.assertEqual(state.node_id('c.cc'), 2)
+        state.clear()
+        self.assertEqual(state.node_id('c.cc'), 0)
+
+    def test_journal_node_ids(self):
+        state = State(self.path)
+        state.save(Config(1))
+        nid = state.node_id('a.cc')
+        state.crcs[nid] = 7
+        state.record(nid)
+        state._close_journal()
+
+        state = State(self.path)
+        self.assertEqual(state.node_id('a.cc'), nid)
+        self.assertEqual(state.crcs.get(nid), 7)
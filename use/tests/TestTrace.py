@@ -0,0 +1,88 @@
+import os, json, time, tempfile, unittest
+from ..Trace import Trace
+
+class Builder(object):
+
+    def __init__(self, cmds):
+        self.cmds = cmds
+
+    def command_strings(self):
+        if self.cmds is None:
+            raise TypeError('no commands')
+        return self.cmds
+
+class Node(object):
+
+    def __init__(self, name, builder=None, invalid=True):
+        self.name = name
+        self.builder = builder
+        self._invalid = invalid
+
+    def __repr__(self):
+        return self.name
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def recorded(self):
+        trace = Trace()
+        with trace.phase('build'):
+            with trace.phase('scan'):
+                time.sleep(0.002)
+            with trace.phase('run'):
+                start = time.time()
+                time.sleep(0.003)
+                trace.job(Node('a.o', Builder(['cc -c a.c', 'touch a.o'])), 0, start, start + 0.001)
+                trace.job(Node('b.o', Builder(None)), 1, start, start + 0.002, failed=True)
+                trace.job(Node('c.o', Builder(['cc -c c.c']), False), 0, start + 0.001, start + 0.001)
+        trace.write(self.path)
+        with open(self.path) as inf:
+            return json.load(inf)
+
+    def test_events(self):
+        data = self.recorded()
+        self.assertEqual(data['displayTimeUnit'], 'ms')
+        events = [e for e in data['traceEvents'] if e['ph'] == 'X']
+        self.assertEqual([e['name'] for e in events], ['scan', 'a.o', 'b.o', 'c.o', 'run', 'build'])
+        for e in events:
+            self.assertEqual(e['pid'], 0)
+            self.assertTrue(isinstance(e['ts'], int) and e['ts'] >= 0)
+            self.assertTrue(isinstance(e['dur'], int) and e['dur'] >= 0)
+
+        # Phases go on the main track and jobs on their slot's.
+        by_name = dict((e['name'], e) for e in events)
+        self.assertEqual([by_name[n]['tid'] for n in ['build', 'scan', 'run']], [0, 0, 0])
+        self.assertEqual([by_name[n]['tid'] for n in ['a.o', 'b.o', 'c.o']], [1, 2, 1])
+        self.assertTrue(by_name['scan']['dur'] >= 2000)
+
+        # Job details.
+        self.assertEqual(by_name['a.o']['args'], {'node': 'a.o', 'command': 'cc -c a.c && touch a.o',
+                                                  'invalidated': True, 'skipped': False, 'failed': False})
+        self.assertEqual(by_name['b.o']['args']['command'], '')
+        self.assertTrue(by_name['b.o']['args']['failed'])
+        self.assertTrue(by_name['c.o']['args']['skipped'])
+
+    def test_nesting(self):
+        events = dict((e['name'], e) for e in self.recorded()['traceEvents'] if e['ph'] == 'X')
+        def inside(inner, outer):
+            return (events[outer]['ts'] <= events[inner]['ts'] and
+                    events[inner]['ts'] + events[inner]['dur'] <= events[outer]['ts'] + events[outer]['dur'])
+        self.assertTrue(inside('scan', 'build'))
+        self.assertTrue(inside('run', 'build'))
+        self.assertFalse(inside('scan', 'run') or inside('run', 'scan'))
+        for name in ['a.o', 'b.o', 'c.o']:
+            self.assertTrue(inside(name, 'run'))
+
+    def test_thread_names(self):
+        meta = [e for e in self.recorded()['traceEvents'] if e['ph'] == 'M']
+        self.assertEqual([(e['tid'], e['name'], e['args']['name']) for e in meta],
+                         [(0, 'thread_name', 'main'), (1, 'thread_name', 'slot 0'), (2, 'thread_name', 'slot 1')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os, sys, time, threading, traceback, unittest
+from ..utils import run_threaded, run_processes, ProcessPool
+
+def double(x):
+    return x*2, os.getpid()
+
+class TestUtils(unittest.TestCase):
+
+    def test_serial(self):
+        done = []
+        run_threaded(lambda x: done.append((x, threading.current_thread())), range(5), 1)
+        self.assertEqual(done, [(x, threading.current_thread()) for x in range(5)])
+
+    def test_threaded(self):
+        done = []
+        lock = threading.Lock()
+        def func(x):
+            time.sleep(0.001)
+            with lock:
+                done.append((x, threading.current_thread()))
+        run_threaded(func, xrange(100), 4)
+
+        # Each item is handled exactly once, away from this thread.
+        self.assertEqual(sorted(x for x, thr in done), range(100))
+        self.assertNotIn(threading.current_thread(), [thr for x, thr in done])
+        self.assertTrue(len(set(thr for x, thr in done)) > 1)
+
+    def test_order(self):
+        taken = []
+        def func(x):
+            taken.append(x)
+            time.sleep(0.01)
+
+        # Items are handed out in order, so the first few start first.
+        run_threaded(func, range(8), 4)
+        self.assertEqual(sorted(taken[:4]), range(4))
+        self.assertEqual(sorted(taken), range(8))
+
+    def test_error(self):
+        def failing(x):
+            if x == 3:
+                raise ValueError('item %d'%x)
+        for num_threads in [1, 4]:
+            try:
+                run_threaded(failing, range(10), num_threads)
+            except ValueError:
+                exc, tb = sys.exc_info()[1:]
+            else:
+                self.fail('error not raised')
+
+            # The original error is raised, traceback and all.
+            self.assertEqual(str(exc), 'item 3')
+            self.assertEqual(traceback.extract_tb(tb)[-1][2], 'failing')
+
+    def test_stop_after_error(self):
+        done = []
+        def func(x):
+            if x == 0:
+                raise ValueError()
+            time.sleep(0.001)
+            done.append(x)
+
+        # Workers finish what they started, then take no more.
+        self.assertRaises(ValueError, run_threaded, func, range(1000), 4)
+        self.assertTrue(len(done) < 100)
+
+    def test_processes(self):
+        serial = run_processes(double, range(10), 1, min_items=1)
+        self.assertEqual(serial, [(x*2, os.getpid()) for x in range(10)])
+
+        # Results come back in order from the pool's processes.
+        pooled = run_processes(double, range(10), 2, min_items=1)
+        self.assertEqual([r for r, pid in pooled], [r for r, pid in serial])
+        self.assertNotIn(os.getpid(), [pid for r, pid in pooled])
+
+        # Small batches are run here.
+        self.assertEqual(run_processes(double, range(10), 2), serial)
+
+    def test_pool_reused(self):
+        pool = ProcessPool(2, min_items=4)
+        try:
+            self.assertEqual(pool.map(double, range(3)), [double(x) for x in range(3)])
+            self.assertIsNone(pool._pool)
+            first = pool.map(double, range(8))
+            started = pool._pool
+            second = pool.map(double, range(8, 16))
+            self.assertIs(pool._pool, started)
+        finally:
+            pool.close()
+        self.assertIsNone(pool._pool)
+        self.assertEqual([r for r, pid in first + second], [x*2 for x in range(16)])
+
+if __name__ == '__main__':
+    unittest.main()
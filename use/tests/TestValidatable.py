@@ -0,0 +1,73 @@
+import os, tempfile, unittest
+from .. import Digest as digest_module
+from ..Digest import file_digest
+from ..Validatable import Validatable
+
+class Context(object):
+
+    def __init__(self):
+        self.digest_type = 'crc32'
+        self.stats = {}
+
+    def node_stat(self, node):
+        return self.stats.get(node, None)
+
+class TestValidatable(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.write(fd, 'some data\n')
+        os.close(fd)
+        self.ctx = Context()
+        self.node = Validatable()
+        self.opened = []
+        real_open = open
+        def counting_open(path, *args):
+            self.opened.append(path)
+            return real_open(path, *args)
+        digest_module.open = counting_open
+
+    def tearDown(self):
+        del digest_module.open
+        os.remove(self.path)
+
+    def stored(self, crc):
+        self.node._crc = crc
+        self.ctx.stats[self.node] = self.node._stat_file(self.path)
+
+    def test_matching_stat_reuses_crc(self):
+        self.stored('stored')
+        self.assertEqual(self.node._digest_file_cached(self.path, self.ctx), 'stored')
+        self.assertEqual(self.opened, [])
+        self.assertEqual(self.node._stat, self.ctx.stats[self.node])
+
+    def test_changed_size_hashes(self):
+        self.stored('stored')
+        with open(self.path, 'a') as out:
+            out.write('more\n')
+        crc = self.node._digest_file_cached(self.path, self.ctx)
+        self.assertEqual(self.opened, [self.path])
+        self.assertEqual(crc, file_digest(self.path))
+
+    def test_changed_mtime_hashes(self):
+        self.stored('stored')
+        st = os.stat(self.path)
+        os.utime(self.path, (st.st_atime, st.st_mtime + 10))
+        crc = self.node._digest_file_cached(self.path, self.ctx)
+        self.assertEqual(self.opened, [self.path])
+        self.assertEqual(crc, file_digest(self.path))
+
+    def test_missing_crc_hashes(self):
+        self.stored(None)
+        crc = self.node._digest_file_cached(self.path, self.ctx)
+        self.assertEqual(self.opened, [self.path])
+        self.assertEqual(crc, file_digest(self.path))
+
+    def test_missing_file(self):
+        self.stored('stored')
+        self.assertIsNone(self.node._digest_file_cached(self.path + '.missing', self.ctx))
+        self.assertIsNone(self.node._stat)
+        self.assertEqual(self.opened, [])
+
+if __name__ == '__main__':
+    unittest.main()
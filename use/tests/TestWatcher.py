@@ -0,0 +1,55 @@
+import os, shutil, tempfile, unittest
+from ..Watcher import Watcher, make_watcher
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = [os.path.join(self.dir, n) for n in ['a.cc', 'b.cc']]
+        for path in self.paths:
+            self.write(path, 'int a;\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, path, data, mode='w'):
+        with open(path, mode) as out:
+            out.write(data)
+
+    def test_modified(self):
+        watcher = Watcher(self.paths, interval=0.01)
+        self.write(self.paths[0], 'int b;\n', 'a')
+        self.assertEqual(watcher.wait(), set([self.paths[0]]))
+
+        # Changes are only reported once.
+        self.write(self.paths[1], 'int b;\n', 'a')
+        self.assertEqual(watcher.wait(), set([self.paths[1]]))
+
+    def test_removed(self):
+        watcher = Watcher(self.paths, interval=0.01)
+        os.remove(self.paths[1])
+        self.assertEqual(watcher.wait(), set([self.paths[1]]))
+
+    def test_update(self):
+        watcher = Watcher(self.paths[:1], interval=0.01)
+        watcher.update(self.paths)
+        self.write(self.paths[1], 'int b;\n', 'a')
+        self.assertEqual(watcher.wait(), set([self.paths[1]]))
+
+    def test_timeout(self):
+        watcher = Watcher(self.paths, interval=0.01)
+        self.assertEqual(watcher.wait(0.05), set())
+        self.write(self.paths[0], 'int b;\n', 'a')
+        self.assertEqual(watcher.wait(0.05), set([self.paths[0]]))
+
+    def test_make_watcher(self):
+        watcher = make_watcher(self.paths)
+        try:
+            self.write(self.paths[0], 'int b;\n', 'a')
+            self.assertEqual(watcher.wait(), set([self.paths[0]]))
+            self.assertEqual(watcher.wait(0.05), set())
+        finally:
+            watcher.close()
+
+if __name__ == '__main__':
+    unittest.main()
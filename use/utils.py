@@ -1,4 +1,4 @@
-import sys, os, shlex, errno
+import sys, os, shlex, errno, threading, multiprocessing
 from subprocess import Popen, PIPE
 
 def getarg(name, args, kwargs, required=True):
@@ -24,7 +24,7 @@ def strip_missing(dirs):
     return [d for d in dirs if os.path.exists(d)]
 
 def run_command(command, show_stdout=False):
-    proc = Popen(shlex.split(command), stdout=PIPE, stderr=PIPE)
+    proc = Popen(shlex.split(command), stdout=PIPE, stderr=PIPE, close_fds=False)
     if show_stdout:
         while proc.poll() is None:
             sys.stdout.write(proc.stdout.read())
@@ -40,3 +40,77 @@ def make_dirs(path):
             pass
         else:
             raise
+
+##
+## Call func on each item using a pool of threads. Only useful when
+## func spends its time outside the GIL, such as in file I/O.
+##
+def run_threaded(func, items, num_threads):
+    items = list(items)
+    if num_threads <= 1 or len(items) <= 1:
+        for item in items:
+            func(item)
+        return
+
+    lock = threading.Lock()
+    it = iter(items)
+    errors = []
+    def worker():
+        while not errors:
+            with lock:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            try:
+                func(item)
+            except:
+                errors.append(sys.exc_info())
+
+    threads = [threading.Thread(target=worker) for ii in range(min(num_threads, len(items)))]
+    for thr in threads:
+        thr.daemon = True
+        thr.start()
+    for thr in threads:
+        while thr.is_alive():
+            thr.join(0.1)
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+
+##
+## A pool of processes for CPU bound work that the GIL would
+## serialise. func must be a module level function, and items and
+## results must pickle. Batches too small to pay for the pool are run
+## here. The processes are only started for the first big enough batch,
+## then kept for later ones until closed.
+##
+class ProcessPool(object):
+
+    def __init__(self, num_procs, min_items=64):
+        self.num_procs = num_procs
+        self.min_items = min_items
+        self._pool = None
+
+    def map(self, func, items):
+        items = list(items)
+        if self.num_procs <= 1 or len(items) < self.min_items:
+            return [func(item) for item in items]
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.num_procs)
+        return self._pool.map(func, items, max(1, len(items)//(self.num_procs*4)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+##
+## Map func over items using a pool of processes just for this batch.
+##
+def run_processes(func, items, num_procs, min_items=64):
+    pool = ProcessPool(num_procs, min_items)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()